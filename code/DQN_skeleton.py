@@ -31,10 +31,151 @@ class LinearDeepQNetwork(nn.Module):
         return actions
 
 
+class ReplayBuffer():
+    """
+    Transitions kept in preallocated ring arrays, the oldest one is
+    overwritten when the buffer is full
+    """
+    def __init__(self, max_size, input_dims):
+        self.mem_size = max_size
+        self.mem_cntr = 0
+        self.state_memory = np.zeros((self.mem_size, input_dims), dtype=np.float32)
+        self.new_state_memory = np.zeros((self.mem_size, input_dims), dtype=np.float32)
+        self.action_memory = np.zeros(self.mem_size, dtype=np.int64)
+        self.reward_memory = np.zeros(self.mem_size, dtype=np.float32)
+        self.terminal_memory = np.zeros(self.mem_size, dtype=np.bool_)
+
+    def store_transition(self, state, action, reward, state_, done):
+        index = self.mem_cntr % self.mem_size
+        self.state_memory[index] = state  #copied, the caller may reuse its arrays
+        self.new_state_memory[index] = state_
+        self.action_memory[index] = action
+        self.reward_memory[index] = reward
+        self.terminal_memory[index] = done
+        self.mem_cntr += 1
+
+    def store_batch(self, states, actions, rewards, states_, dones):
+        """
+        Store n transitions at once (n <= mem_size)
+        Return their positions in the ring arrays
+        """
+        index = (self.mem_cntr + np.arange(len(actions))) % self.mem_size
+        self.state_memory[index] = states
+        self.new_state_memory[index] = states_
+        self.action_memory[index] = actions
+        self.reward_memory[index] = rewards
+        self.terminal_memory[index] = dones
+        self.mem_cntr += len(actions)
+        return index
+
+    def sample_buffer(self, batch_size, rng=None):
+        """
+        Uniform minibatch (with replacement) of the stored transitions
+        """
+        max_mem = min(self.mem_cntr, self.mem_size)
+        if rng is not None:
+            batch = rng.randints(0, max_mem - 1, batch_size)
+        else:
+            batch = np.random.randint(0, max_mem, batch_size)
+        return (self.state_memory[batch], self.action_memory[batch], self.reward_memory[batch],
+                self.new_state_memory[batch], self.terminal_memory[batch])
+
+
+class SumTree():
+    """
+    Array-backed binary sum tree over capacity leaves (rounded up to a
+    power of two): tree[1] is the total, tree[i] = tree[2i] + tree[2i+1]
+    and leaf k is tree[size + k]
+    Updates and prefix-sum searches take O(log n), done for a whole batch
+    with one array step per level
+    """
+    def __init__(self, capacity):
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.depth = self.size.bit_length() - 1
+        self.tree = np.zeros(2 * self.size)
+
+    def total(self):
+        return self.tree[1]
+
+    def update(self, leaf, priority):
+        idx = np.asarray(leaf) + self.size
+        self.tree[idx] = priority
+        for _ in range(self.depth):
+            idx = idx // 2
+            self.tree[idx] = self.tree[2 * idx] + self.tree[2 * idx + 1]
+
+    def find(self, value):
+        """
+        Leaf of each value: the first leaf whose prefix sum reaches it
+        """
+        idx = np.ones(len(value), dtype=np.int64)
+        value = np.array(value, dtype=np.float64)
+        for _ in range(self.depth):
+            left = 2 * idx
+            right = value > self.tree[left]
+            value -= self.tree[left] * right
+            idx = left + right
+        return idx - self.size
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Transitions sampled in proportion to priority^alpha,
+    the priority of a transition is its last |TD error| + eps
+    New transitions get the highest priority seen so far
+    """
+    def __init__(self, max_size, input_dims, alpha=0.6, beta=0.4, beta_inc=1e-4, eps=1e-5):
+        super(PrioritizedReplayBuffer, self).__init__(max_size, input_dims)
+        self.tree = SumTree(max_size)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_inc = beta_inc
+        self.eps = eps
+        self.max_priority = 1.0
+
+    def store_transition(self, state, action, reward, state_, done):
+        self.tree.update(self.mem_cntr % self.mem_size, self.max_priority ** self.alpha)
+        super(PrioritizedReplayBuffer, self).store_transition(state, action, reward, state_, done)
+
+    def store_batch(self, states, actions, rewards, states_, dones):
+        index = super(PrioritizedReplayBuffer, self).store_batch(states, actions, rewards, states_, dones)
+        self.tree.update(index, self.max_priority ** self.alpha)
+        return index
+
+    def sample_buffer(self, batch_size, rng=None):
+        """
+        One value in each of batch_size equal segments of the total
+        Also return the sampled positions and their importance-sampling
+        weights (N * P(i))^-beta, scaled so the largest is 1
+        """
+        max_mem = min(self.mem_cntr, self.mem_size)
+        total = self.tree.total()
+        u = rng.draw(batch_size) if rng is not None else np.random.random(batch_size)
+        batch = self.tree.find((np.arange(batch_size) + u) * (total / batch_size))
+        batch = np.minimum(batch, max_mem - 1)  #rounding at the end of the tree
+        prob = self.tree.tree[batch + self.tree.size] / total
+        weights = (max_mem * prob) ** -self.beta
+        weights = (weights / weights.max()).astype(np.float32)
+        self.beta = min(1.0, self.beta + self.beta_inc)
+        return (self.state_memory[batch], self.action_memory[batch], self.reward_memory[batch],
+                self.new_state_memory[batch], self.terminal_memory[batch], batch, weights)
+
+    def update_priorities(self, batch, td_error):
+        priority = np.abs(td_error) + self.eps
+        self.max_priority = max(self.max_priority, float(priority.max()))
+        self.tree.update(batch, priority ** self.alpha)
+
+
 class Agent():
     def __init__(self, input_dims, n_actions, lr, gamma=0.99,
-                 epsilon=1.0, eps_dec=1e-5, eps_min=0.01):
+                 epsilon=1.0, eps_dec=1e-5, eps_min=0.01, rng=None,
+                 mem_size=10000, batch_size=64, learn_every=4,
+                 prioritized=False, alpha=0.6, beta=0.4,
+                 target_update=None, tau=None, double=False):
         self.lr = lr
+        self.rng = rng  #rng.Draws of the agent stream, None: np.random
         self.input_dims = input_dims
         self.n_actions = n_actions
         self.gamma = gamma
@@ -44,39 +185,126 @@ class Agent():
         self.action_space = [i for i in range(self.n_actions)]
 
         self.Q = LinearDeepQNetwork(self.lr, self.n_actions, self.input_dims)
+        #one batched update every learn_every transitions
+        #mem_size=1, batch_size=1, learn_every=1 is the old online update
+        #prioritized: sample by TD error, weight the loss by importance sampling
+        self.prioritized = prioritized
+        if prioritized:
+            self.memory = PrioritizedReplayBuffer(mem_size, input_dims, alpha, beta)
+        else:
+            self.memory = ReplayBuffer(mem_size, input_dims)
+        self.batch_size = batch_size
+        self.learn_every = learn_every
+        #target network: copied from Q every target_update updates,
+        #or moved by tau towards Q after each update (Polyak)
+        #None for both: q_next comes from Q itself
+        #double: the online Q picks the next action, the target evaluates it
+        self.target_update = target_update
+        self.tau = tau
+        self.double = double
+        self.learn_step_cntr = 0
+        self.Q_target = None
+        if target_update is not None or tau is not None:
+            self.Q_target = LinearDeepQNetwork(self.lr, self.n_actions, self.input_dims)
+            self.Q_target.load_state_dict(self.Q.state_dict())
+            for p in self.Q_target.parameters():
+                p.requires_grad_(False)
 
     def choose_action(self, state):
-        if np.random.random() > self.epsilon:
+        u = self.rng.random() if self.rng is not None else np.random.random()
+        if u > self.epsilon:
             state1 = T.tensor(state, dtype=T.float).to(self.Q.device)
             # state =
             actions = self.Q.forward(state1)
             action = T.argmax(actions).item()
+        elif self.rng is not None:
+            action = self.action_space[self.rng.randint(0, self.n_actions - 1)]
         else:
             action = np.random.choice(self.action_space)
 
         return action
 
+    def choose_actions(self, states):
+        """
+        Epsilon-greedy actions of a [K, input_dims] batch of states,
+        one forward pass for all greedy rows
+        """
+        k = len(states)
+        u = self.rng.draw(k) if self.rng is not None else np.random.random(k)
+        greedy = u > self.epsilon
+        actions = np.empty(k, dtype=np.int64)
+        if greedy.any():
+            with T.no_grad():
+                q = self.Q.forward(T.from_numpy(states[greedy]).float().to(self.Q.device))
+            actions[greedy] = q.argmax(dim=1).cpu().numpy()
+        n = k - int(greedy.sum())
+        if self.rng is not None:
+            actions[~greedy] = self.rng.randints(0, self.n_actions - 1, n)
+        else:
+            actions[~greedy] = np.random.randint(0, self.n_actions, n)
+        return actions
+
     def decrement_epsilon(self):
         self.epsilon = self.epsilon - self.eps_dec \
                         if self.epsilon > self.eps_min else self.eps_min
 
-    def learn(self, state, action, reward, state_):
-        self.Q.optimizer.zero_grad()
-        states = T.tensor(state, dtype=T.float).to(self.Q.device)
-        actions = T.tensor(action).to(self.Q.device)
-        rewards = T.tensor(reward).to(self.Q.device)
-        states_ = T.tensor(state_, dtype=T.float).to(self.Q.device)
+    def learn(self, state, action, reward, state_, done=False):
+        self.memory.store_transition(state, action, reward, state_, done)
+        self.decrement_epsilon()
+        if self.memory.mem_cntr < self.batch_size or self.memory.mem_cntr % self.learn_every != 0:
+            return
+        self.update()
 
-        q_pred = self.Q.forward(states)[actions]
+    def update(self):
+        """
+        One batched SGD step on a minibatch of the replay buffer
+        """
+        sample = self.memory.sample_buffer(self.batch_size, self.rng)
+        state, action, reward, state_, done = sample[:5]
+        states = T.from_numpy(state).to(self.Q.device)
+        actions = T.from_numpy(action).to(self.Q.device)
+        rewards = T.from_numpy(reward).to(self.Q.device)
+        states_ = T.from_numpy(state_).to(self.Q.device)
+        dones = T.from_numpy(done).to(self.Q.device)
+
+        self.Q.optimizer.zero_grad()
+        indices = T.arange(self.batch_size, device=self.Q.device)
+        q_pred = self.Q.forward(states)[indices, actions]
 
-        q_next = self.Q.forward(states_).max()
+        with T.no_grad():  #the bootstrap target is a constant of the loss
+            if self.Q_target is None:
+                q_eval = self.Q.forward(states_)
+            else:
+                q_eval = self.Q_target.forward(states_)
+            if self.double:
+                q_next = q_eval[indices, self.Q.forward(states_).argmax(dim=1)]
+            else:
+                q_next = q_eval.max(dim=1)[0]
+        q_next[dones] = 0.0
 
-        q_target = reward + self.gamma*q_next
+        q_target = rewards + self.gamma*q_next
 
-        loss = self.Q.loss(q_target, q_pred).to(self.Q.device)
+        if self.prioritized:
+            batch, weights = sample[5:]
+            td_error = q_target - q_pred
+            loss = (T.from_numpy(weights).to(self.Q.device) * td_error ** 2).mean()
+            self.memory.update_priorities(batch, td_error.detach().cpu().numpy())
+        else:
+            loss = self.Q.loss(q_target, q_pred).to(self.Q.device)
         loss.backward()
         self.Q.optimizer.step()
-        self.decrement_epsilon()
+        self.learn_step_cntr += 1
+        self.sync_target()
+
+    def sync_target(self):
+        if self.Q_target is None:
+            return
+        if self.tau is not None:
+            with T.no_grad():
+                for p, p_target in zip(self.Q.parameters(), self.Q_target.parameters()):
+                    p_target.mul_(1 - self.tau).add_(self.tau * p)
+        elif self.learn_step_cntr % self.target_update == 0:
+            self.Q_target.load_state_dict(self.Q.state_dict())
 
     def processDQN_stage1(self, initial_state):
         action = self.choose_action(initial_state)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#######################################################
+# Ape-X style training of the two stage DQN of        #
+# env_dqn: actor processes run their own environment  #
+# with a fixed epsilon and send transitions to one    #
+# learner, which owns the networks and the replay     #
+# buffers and publishes its weights in shared memory  #
+#######################################################
+
+import time
+import queue
+import argparse
+import numpy as np
+import multiprocessing as mp
+
+STAGES = 2  #farm (stage 1) and server (stage 2) agents
+
+
+class Recorder(object):
+    """
+    Takes the place of one agent in env_dqn.runDQN on an actor:
+    learn() only collects the transitions, sent in chunks to the learner
+    """
+    def __init__(self, stage, out, chunk):
+        self.stage = stage
+        self.out = out
+        self.chunk = chunk
+        self.rows = []
+
+    def learn(self, state, action, reward, state_, done=False):
+        self.rows.append((np.array(state, dtype=np.float32), action, reward,
+                          np.array(state_, dtype=np.float32), done))  #state arrays are reused by the env
+        if len(self.rows) == self.chunk:
+            self.flush()
+
+    def flush(self):
+        if len(self.rows) == 0:
+            return
+        state, action, reward, state_, done = zip(*self.rows)
+        self.out.put(("data", self.stage, np.stack(state), np.array(action, dtype=np.int64),
+                      np.array(reward, dtype=np.float32), np.stack(state_), np.array(done, dtype=np.bool_)))
+        self.rows = []
+
+
+def getWeights(net):
+    import torch
+    return torch.nn.utils.parameters_to_vector(net.parameters()).detach().cpu().numpy()
+
+
+def setWeights(net, weights):
+    import torch
+    torch.nn.utils.vector_to_parameters(torch.from_numpy(weights).to(net.device), net.parameters())
+
+
+def actorEpsilon(i, num, eps=0.4, alpha=7.0):
+    """
+    Epsilon of actor i of num, eps^(1 + alpha * i / (num - 1)) as in Ape-X
+    """
+    if num == 1:
+        return eps
+    return eps ** (1 + alpha * i / (num - 1))
+
+
+def runActor(job):
+    """
+    Actor process: one environment scheduled with local copies of the
+    networks, reloaded when the learner publishes new weights
+    job: (actor index, epsilon, env args, env seed, shared weights, version, queue, chunk, sync)
+    """
+    i, epsilon, (scale, fname, num_task, num_server, window, speedup), seed, shared, version, out, chunk, sync = job
+    import torch
+    torch.set_num_threads(1)  #one core per actor
+    from env_dqn import environment, step
+    env = environment(scale, fname, num_task, num_server, window, speedup, seed)
+    env.initTraining()
+    time_start = time.time()
+    env.setFarm()
+    agents = env.makeAgents(epsilon=epsilon, eps_dec=0.0, eps_min=epsilon, mem_size=1)
+    seen = -1
+    recorders = [Recorder(stage, out, chunk) for stage in range(STAGES)]
+    run = env.runDQN(*recorders)
+    state = step(run, None)
+    n = 0
+    while state is not None:
+        if n % sync == 0 and version.value != seen:
+            seen = version.value
+            for stage in range(STAGES):
+                with shared[stage].get_lock():
+                    weights = np.frombuffer(shared[stage].get_obj(), dtype=np.float32).copy()
+                setWeights(agents[stage].Q, weights)
+        f = agents[0].processDQN_stage1(state)
+        s = agents[1].processDQN_stage2(state)
+        state = step(run, (f, s))
+        n += 1
+    for r in recorders:
+        r.flush()
+    env.report(time.time() - time_start)
+    out.put(("done", i, {"actor": i, "epsilon": round(epsilon, 4), "tasks": env.num_task,
+                         "reject": env.rejRate, "time": env.timecost, "cost": round(float(env.totalcost), 3)}))
+
+
+def train(scale, fname, num_task, num_server, actors=4, seed=0, window=None, speedup=None,
+          chunk=64, sync=100, publish=50, **kwargs):
+    """
+    Run actors processes against one learner (this process)
+    chunk: transitions per message of an actor
+    sync: an actor checks for new weights every sync decisions
+    publish: the learner publishes its weights every publish updates
+    kwargs: Agent options of the learner (mem_size, batch_size, learn_every,
+    prioritized, target_update, tau, double)
+    Return the learner agents and the metrics of each actor
+    """
+    from env_dqn import environment
+    env = environment(scale, fname, num_task, num_server, window, speedup, seed)  #only for the state size and the agents
+    env.setFarm()
+    for name in ("prioritized", "target_update", "tau", "double"):
+        if name in kwargs:
+            setattr(env, name, kwargs.pop(name))
+    agents = env.makeAgents(**kwargs)
+    ctx = mp.get_context('spawn')
+    shared = []
+    for agent in agents:
+        weights = getWeights(agent.Q)
+        shared.append(ctx.Array('f', len(weights)))
+        np.frombuffer(shared[-1].get_obj(), dtype=np.float32)[:] = weights
+    version = ctx.Value('i', 0)
+    out = ctx.Queue(maxsize=16 * actors)  #actors wait when the learner falls behind
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(actors)]
+    args = (scale, fname, num_task, num_server, window, speedup)
+    procs = [ctx.Process(target=runActor, args=((i, actorEpsilon(i, actors), args, seeds[i], shared, version,
+                                                 out, chunk, sync),)) for i in range(actors)]
+    for p in procs:
+        p.start()
+    rows = {}
+    pending = [0] * STAGES  #transitions received since the last update
+    updates = 0
+    try:
+        while len(rows) != actors:
+            try:
+                msg = out.get(timeout=1)
+            except queue.Empty:
+                if any(p.exitcode not in (None, 0) for p in procs):
+                    raise RuntimeError("an actor failed")
+                continue
+            if msg[0] == "done":
+                rows[msg[1]] = msg[2]
+                continue
+            stage = msg[1]
+            agent = agents[stage]
+            agent.memory.store_batch(*msg[2:])
+            pending[stage] += len(msg[3])
+            while pending[stage] >= agent.learn_every and agent.memory.mem_cntr >= agent.batch_size:
+                pending[stage] -= agent.learn_every
+                agent.update()
+                updates += 1
+                if updates % publish == 0:
+                    for s in range(STAGES):
+                        weights = getWeights(agents[s].Q)
+                        with shared[s].get_lock():
+                            np.frombuffer(shared[s].get_obj(), dtype=np.float32)[:] = weights
+                    version.value += 1
+    finally:
+        for p in procs:
+            if len(rows) != actors and p.is_alive():  #an actor or the learner failed, stop the others
+                p.terminate()
+            p.join()
+    print("learner updates:", updates)
+    return agents, [rows[i] for i in range(actors)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ape-X style DQN training: actor processes and one learner")
+    parser.add_argument("trace", nargs='?', default="output_5000.txt")
+    parser.add_argument("--actors", type=int, default=4)
+    parser.add_argument("--tasks", type=int, default=5000, help="tasks run by each actor")
+    parser.add_argument("--servers", type=int, default=100)
+    parser.add_argument("--scale", default='small', choices=['small', 'large'])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prioritized", action='store_true')
+    parser.add_argument("--double", action='store_true')
+    parser.add_argument("--target-update", type=int, default=None)
+    args = parser.parse_args()
+    t = time.time()
+    _, rows = train(args.scale, args.trace, args.tasks, args.servers, args.actors, args.seed,
+                    prioritized=args.prioritized, double=args.double, target_update=args.target_update)
+    fields = ["actor", "epsilon", "tasks", "reject", "time", "cost"]
+    print(" ".join("%-10s" % f for f in fields))
+    for row in rows:
+        print(" ".join("%-10s" % row[f] for f in fields))
+    print("total tasks/s:", round(sum(row["tasks"] for row in rows) / (time.time() - t)))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#######################################################
+# structure-of-arrays state of the RP/TS processor    #
+# remaining CPU, RAM and disk of every VM are kept in #
+# contiguous float64 arrays shaped [farm, server, VM] #
+#######################################################
+
+import numpy as np
+
+
+class Cluster(object):
+    """
+    Remaining resources of all farms, servers and VMs
+    res[0], res[1], res[2]: remaining CPU, RAM and disk of each VM
+    cpu, ram, disk are views into res, shaped [farm, server, VM]
+    farm: remaining CPU, RAM and disk of each farm
+    state: flat view of CPU and RAM used as the DQN input
+    """
+    def __init__(self, farmNum, severNum, VMNum):
+        """
+        farmNum: number of farms
+        severNum: number of servers in each farm
+        VMNum: number of VMs in each server
+        Each server has unit CPU, RAM and disk, each VM has 1/VMNum of them
+        float64 like the python floats of the tasks: in float32 an idle
+        server sums to just under its capacity and keeps its static power
+        """
+        self.farmNum = farmNum
+        self.severNum = severNum
+        self.VMNum = VMNum
+        self.res = np.full((3, farmNum, severNum, VMNum), 1.0/VMNum, dtype=np.float64)
+        self.cpu = self.res[0]
+        self.ram = self.res[1]
+        self.disk = self.res[2]
+        self.farm = np.full((3, farmNum), float(severNum))
+        self.state = self.res[:2].reshape(-1)  #no copy, always up to date
+
+    def place(self, farm_i, server_i, vm_j, task):
+        """
+        Take the task's CPU, RAM and disk from VM vm_j
+        of server server_i in farm farm_i
+        """
+        cpu, ram, disk = task.CPU, task.RAM, task.disk
+        self.cpu[farm_i, server_i, vm_j] -= cpu
+        self.ram[farm_i, server_i, vm_j] -= ram
+        self.disk[farm_i, server_i, vm_j] -= disk
+        self.farm[0, farm_i] -= cpu
+        self.farm[1, farm_i] -= ram
+        self.farm[2, farm_i] -= disk
+
+    def release(self, farm_i, server_i, vm_j, task):
+        """
+        Give the task's CPU, RAM and disk back to VM vm_j
+        of server server_i in farm farm_i
+        """
+        cpu, ram, disk = task.CPU, task.RAM, task.disk
+        self.cpu[farm_i, server_i, vm_j] += cpu
+        self.ram[farm_i, server_i, vm_j] += ram
+        self.disk[farm_i, server_i, vm_j] += disk
+        self.farm[0, farm_i] += cpu
+        self.farm[1, farm_i] += ram
+        self.farm[2, farm_i] += disk
+
+
+def firstFit(cpu, ram, task, cursor):
+    """
+    Placement kernel of the Round-Robin baseline
+    cpu, ram: [server, VM] remaining resources
+    Return the first (server, VM) with enough CPU and RAM
+    visiting servers from cursor (wrap around) and VMs in order
+    Return (-1, -1) if no VM fits the task
+    """
+    fit = (cpu >= task.CPU) & (ram >= task.RAM)  #the same as the remain_cpu >= 0 check of checkRej
+    flat = fit.reshape(-1)
+    k = cursor * fit.shape[1]
+    i = int(flat[k:].argmax()) + k  #first fit at or after the cursor
+    if not flat[i]:
+        i = int(flat[:k].argmax()) if k > 0 else 0  #wrap around
+        if not flat[i]:
+            return -1, -1
+    return divmod(i, fit.shape[1])
@@ -11,8 +11,14 @@
 #######################################################
 
 from DQN_skeleton import *
+from collections import deque
+from sys import intern
+from simulator import Simulator, Monitor, ARRIVAL, COMPLETION, RELEASE
+from cluster import Cluster
+from power import PowerModel
+from tracefile import openTrace, isTrace
+from rng import Streams
 import time
-import random
 
 class Task(object):   
     """
@@ -21,9 +27,11 @@ class Task(object):
     jobID, index, CPU, RAM, disk extracted from user data
     status indicates the current status of the task
     """
+    __slots__ = ('parent', 'child', 'jobID', 'index', 'CPU', 'RAM', 'disk',
+                 'status', 'runtime', 'ddl', 'endtime', 'pending', 'seq',
+                 'arrival', 'link')  #no __dict__ per task
+
     def __init__(self, jobID, index, CPU, RAM, disk, status):
-        import random
-        import time
         self.parent = []
         self.child = []
         self.jobID = jobID
@@ -32,80 +40,167 @@ class Task(object):
         self.RAM = RAM
         self.disk = disk
         self.status = status  #-1: rejected, 0: finished, 1: ready, 2: running
-        self.runtime = random.randint(1, 10)/1000.0
-        self.ddl = time.time() + self.runtime + random.randint(1, 1000) * 100
+        self.runtime = 0.0  #runtime and ddl are drawn job by job, see DAG.initTasks
+        self.ddl = 0.0
         self.endtime = 0
+        self.pending = 0  #number of parents still waiting (status 1)
+        self.seq = 0  #position in the input file
+        self.arrival = 0.0  #simulated time the task arrives
+        self.link = None  #position of the parent in the job given by the trace, -1: none
         
 class DAG(object):
     """
     Transform job queue to task ready queue
     """
-    def __init__(self, fname, num_task):
+    def __init__(self, fname, num_task, window=None, speedup=None, rng=None):
         self.fname = fname
+        self.rng = rng if rng is not None else Streams()  #random streams of the run
         self.num_task = num_task
+        self.speedup = speedup  #replay trace timestamps this many times faster, None puts all tasks at 0
+        self.sim = None  #simulator of the environment, for the arrival events
+        self.monitor = None  #monitor of the environment, for the arrival times
+        self.waiting = 0  #tasks read but not arrived yet
+        self.window = window  #lookahead in queued tasks, None reads all jobs first
+        self.reader = None
+        self.peek = None  #next job of the reader, read but not loaded
         self.job = []
         self.task = []
+        self.ready = deque()  #tasks whose parents are all finished
     
-    def readfile(self):
+    def readJobs(self):
         """
-        Read the input job file
+        Read the input job file lazily, yield one job (list of tasks) at a time
         All task are initialized to ready status
+        fname can also be a binary trace made by tracefile.py
+        or a Trace from workload.py
         """
         num_task = 0
+        if isTrace(self.fname):
+            for rows in openTrace(self.fname).jobs(self.num_task):
+                task = []
+                stamps = []
+                for jobID, index, CPU, RAM, disk, timestamp, link in rows:
+                    task.append(Task(jobID, index, CPU, RAM, disk, 1))
+                    task[-1].link = link
+                    task[-1].seq = num_task
+                    stamps.append(timestamp)
+                    num_task += 1
+                self.initTasks(task, stamps)
+                yield task
+            return
         with open(self.fname, 'r') as f:
-            task = []            
+            task = []
+            stamps = []            
             for line in f:
                 if line[0] == 'J':
                     if len(task) != 0:
-                        self.job.append(task)
+                        self.initTasks(task, stamps)
+                        yield task
                         task = []
+                        stamps = []
                 else:
                     info = list(line.strip(' ').split())
-                    task.append(Task(info[1], info[2], float(info[4]), float(info[5]), info[6], 1))
+                    #ids repeat a lot, keep one string object for each
+                    task.append(Task(intern(info[1]), intern(info[2]), float(info[4]), float(info[5]), float(info[6]), 1))
+                    if len(info) > 7:  #parent column of synthetic.py
+                        task[-1].link = int(info[7])
+                    task[-1].seq = num_task
+                    stamps.append(float(info[0]))
                     num_task += 1
                 if num_task == self.num_task: 
                     break
             if len(task) != 0:
-                self.job.append(task)
-    
-    def checkRing(self, parent, child): 
+                self.initTasks(task, stamps)
+                yield task
+
+    def initTasks(self, task, timestamp):
+        """
+        Draw the runtime and ddl of all tasks of one job at once
+        In replay mode the task arrives at its trace timestamp
+        (microseconds) divided by speedup, its ddl moves with it
+        """
+        runtime = self.rng.task.randints(1, 10, len(task)) / 1000.0
+        ddl = runtime + self.rng.task.randints(1, 1000, len(task)) * 100.0
+        if self.speedup is not None:
+            arrival = np.asarray(timestamp, dtype=np.float64) / 1e6 / self.speedup
+            ddl += arrival
+            for t, a in zip(task, arrival.tolist()):
+                t.arrival = a
+        for t, r, d in zip(task, runtime.tolist(), ddl.tolist()):
+            t.runtime = r
+            t.ddl = d
+
+    def readfile(self):
         """
-        Check whether there is a loop between parent and child
-        Return True if has loop
+        Read the whole input job file
+        All task are initialized to ready status
         """
-        if parent.index == child.index:
-            return True
-        if len(child.child) == 0:
-            return False
-        for c in child.child:
-            if self.checkRing(parent, c):
-                return True
-        return False
-    
-    
+        for job in self.readJobs():
+            self.job.append(job)
+
+    def findRoot(self, root, k):
+        """
+        Find the root of the tree that task k is in
+        root: union-find parent of each task position in the job
+        Iterative with path halving, no recursion
+        """
+        while root[k] != k:
+            root[k] = root[root[k]]
+            k = root[k]
+        return k
+
     def buildDAG(self):
         """
         Randomly build dependencies between tasks within each job
+        Each task gets at most one parent, so every job is a forest
+        and a task is still a tree root when its own parent is drawn
+        The edge parent -> task makes a loop only if parent is in the
+        tree of task, so it is checked with union-find in near constant
+        time instead of walking all children of task
+        Jobs whose trace has a parent column (see synthetic.py)
+        keep the dependencies given there
         """
-        import random
         for job in self.job:           
-            for task in job:
-                i = random.randint(-len(job), len(job) - 1)
+            if len(job) != 0 and job[0].link is not None:
+                for task in job:
+                    if task.link >= 0:
+                        parent = job[task.link]
+                        task.parent.append(parent)
+                        parent.child.append(task)
+                continue
+            root = list(range(len(job)))
+            draw = self.rng.dag.randints(-len(job), len(job) - 1, len(job)).tolist()
+            for k in range(len(job)):
+                task = job[k]
+                i = draw[k]
                 if i < 0:
                     continue
                 parent = job[i]
-                if self.checkRing(parent, task) == False:
+                r = self.findRoot(root, i)
+                if r != k:  #no loop
                     task.parent.append(parent)
                     parent.child.append(task)
-    
+                    root[k] = r
+
     def rejTask(self, task):
         """
         If one task is rejected
         Then all tasks that depended on this task will be rejected
-        """
-        task.status = -1
-        for c in task.child:
-            self.rejTask(c)
+        Walk the child tasks with a stack, each task is visited once
+        Return the set of tasks rejected by this call
+        """
+        rejected = {task}
+        stack = [task]
+        while len(stack) != 0:
+            t = stack.pop()
+            if t.status == 1:
+                self.resolve(t)
+            t.status = -1
+            for c in t.child:
+                if c not in rejected:
+                    rejected.add(c)
+                    stack.append(c)
+        return rejected
     
     def hasParent(self, task):
         """
@@ -122,6 +217,7 @@ class DAG(object):
         Given jobid and taskid, change status of all tasks that depend on it
         If the task with "-1" status, reject this tasks' all child tasks
         If the task with "0" status, remove it from all child tasks
+        Return the set of rejected tasks
         """
 #         job_i, task_i = self.findTask(task.jobID, task.index)
 #         if job_i == -1 or task_i == -1:
@@ -130,29 +226,113 @@ class DAG(object):
 #         job = self.job[job_i]
 #         task = job[task_i]
         if task.status == -1:
-            self.rejTask(task)
+            return self.rejTask(task)
+        return set()
 #         elif task.status == 0:
 #             self.rmParent(task, task_i, job)
     
     def initTask(self):
         """
         run readfile and buildDAG functions
+        With a lookahead window the jobs are read later by loadJobs()
         """
+        if self.window is not None:
+            self.reader = self.readJobs()
+            return
         self.readfile()
         self.buildDAG()
+        self.buildQueue()
+
+    def loadJobs(self, horizon=None):
+        """
+        Read jobs one by one until window tasks are queued (or not arrived yet)
+        or the file ends, build the DAG of each new job
+        and put its ready tasks to the ready deque
+        horizon: in replay mode every job that arrives before it is read too,
+        so the clock never passes an arrival that is not read yet
+        (the jobs should be in arrival order, see workload.py --arrival)
+        """
+        while self.reader is not None:
+            if self.peek is None:
+                self.peek = next(self.reader, None)
+                if self.peek is None:
+                    self.reader = None
+                    break
+            due = horizon is not None and min(t.arrival for t in self.peek) <= horizon
+            if not due and len(self.ready) + len(self.task) + self.waiting >= self.window:
+                break
+            job, self.peek = self.peek, None
+            self.job = [job]  #done jobs are not kept
+            self.buildDAG()
+            self.buildQueue()
+
+    def buildQueue(self):
+        """
+        Count the waiting parents of each task
+        and put the tasks without waiting parent to the ready deque
+        Run once, then the deque is kept by resolve()
+        """
+        for job in self.job:
+            for task in job:
+                task.pending = 0
+                for p in task.parent:
+                    if p.status == 1:
+                        task.pending += 1
+                self.waitArrival(task)
+                if task.status == 1 and task.pending == 0:
+                    self.ready.append(task)
+
+    def waitArrival(self, task):
+        """
+        A task that has not arrived waits for its ARRIVAL event
+        like for one more parent
+        """
+        if self.speedup is not None and task.arrival > self.sim.now:
+            task.pending += 1
+            self.waiting += 1
+            self.sim.schedule(task.arrival, ARRIVAL, task)
+        elif self.speedup is not None and self.monitor is not None:
+            self.monitor.arrive(task.arrival)  #already arrived, no event
+
+    def arrive(self, task):
+        """
+        Called by the ARRIVAL event of one task
+        """
+        self.waiting -= 1
+        task.pending -= 1
+        if task.pending == 0 and task.status == 1:
+            self.ready.append(task)
+
+    def resolve(self, task):
+        """
+        Called once when a task leaves status 1 (running or rejected)
+        A child becomes ready when its last waiting parent is resolved
+        """
+        for c in task.child:
+            c.pending -= 1
+            if c.pending == 0 and c.status == 1:
+                self.ready.append(c)
     
     def taskQueue(self): 
         """
         Build the task ready queue
         Just put the one whose status is 1 
         and whose parent are all finished
-        """
-        for job in self.job:
+        The ready deque is filled by resolve(), so no task is scanned
+        Tasks are queued in file order, the same as scanning all jobs
+        """
+        if self.reader is not None:
+            self.loadJobs()
+        batch = [t for t in self.ready if t.status == 1]  #may be rejected while waiting
+        self.ready.clear()
+        batch.sort(key=lambda t: t.seq)
+        self.task.extend(batch)
+#         for job in self.job:
 #             num_task = len(job)
 #             while num_task > 0:
-            for task in job:
-                if task.status == 1 and self.hasParent(task) == False:
-                    self.task.append(task)
+#             for task in job:
+#                 if task.status == 1 and self.hasParent(task) == False:
+#                     self.task.append(task)
 #                     task.status = 0
 #                     self.updateStatus(task)
 #                     num_task -= 1
@@ -176,7 +356,7 @@ class environment(object):
     calculate the Reward Function
     interface with DQN and baseline
     """
-    def __init__(self, scale, fname, num_task, num_server):
+    def __init__(self, scale, fname, num_task, num_server, window=None, speedup=None, seed=None):
         """
         initial the variable
         We assume each server has 10 VM
@@ -191,7 +371,8 @@ class environment(object):
         self.scale = scale
         self.fname = fname
         self.task = []
-        self.dag = DAG(self.fname, num_task)
+        self.rng = Streams(seed)  #seed None: fresh entropy
+        self.dag = DAG(self.fname, num_task, window, speedup, self.rng)
         self.VMNum = 5
         self.rej = 0
         self.num_task = num_task
@@ -203,23 +384,27 @@ class environment(object):
 #             self.severNum = 4000
             self.farmNum = int(self.severNum / 50)
         # self.init_severs()
-        self.remainFarm = []
-        self.FarmResources = []
+        self.cluster = None  #built by setFarm
         self.severs = [[1,1]for _ in range(self.severNum)]
         self.VMtask = []
         self.totalcost = 0
+        self.sim = Simulator()
+        self.dag.sim = self.sim
+        self.monitor = Monitor()
+        self.dag.monitor = self.monitor
+        self.power = PowerModel()
+        self.prioritized = False  #prioritized replay for both DQN agents
+        self.target_update = None  #copy Q to a target network every n updates
+        self.tau = None  #or move the target network by tau after each update
+        self.double = False  #Double-DQN target
 #         print("Total Number of tasks: {0}".format(num_task))
 
     def init_severs(self, severNum):
         """
-        Set the initial values for each VMs
-        Each VM has 1/n unit CPU and RAM
-        Each VM has a task list
+        Set the initial task list of each VM in one farm
+        The remaining CPU and RAM of the VMs are kept in self.cluster
         """
-        VM = [[[1.0/self.VMNum, 1.0/self.VMNum]for _ in range(self.VMNum)]for _ in range(severNum)]
-#         VM = [[[1.0 , 1.0 ] for _ in range(self.VMNum)] for _ in range(severNum)]
-        self.VMtask.append([[[]for _ in range(self.VMNum)]for _ in range(severNum)])
-        return VM
+        self.VMtask.append([[set()for _ in range(self.VMNum)]for _ in range(severNum)])
     
     def generateQueue(self):
         self.dag.taskQueue()
@@ -231,59 +416,44 @@ class environment(object):
         Each farm has at least 1 server and at most 2*m/n-1 servers
         Initial power usage for each servers and each farm
         """
-        import random
         self.farmOri = []
         m = self.severNum
         n = self.farmNum
         f = int(self.severNum / self.farmNum)
+        self.cluster = Cluster(self.farmNum, f, self.VMNum)
+        self.monitor.watch(self.cluster)
+        self.statePre = np.empty_like(self.cluster.state)  #state before each placement
         for _ in range(self.farmNum):
 #             f = random.randint(0,int(2*m/n))
 #             f = random.randint(1, int(2 * m / n))
-            self.remainFarm.append(self.init_severs(f))
-            self.FarmResources.append([f, f])
+            self.init_severs(f)
             self.farmOri.append(f)
             m -= f
             n -= 1
 
         self.farmOri.append(m)
-        self.pwrPre = [0]*self.severNum #power usage pre sever
+        self.pwrPre = np.zeros((self.farmNum, f)) #power usage pre sever
+        self.pwrSum = 0.0 #running total of pwrPre
+        self.changed = set() #(farm, server) whose utilization changed since the last reward
         self.pwrPFarm = [0]*self.farmNum #power usage per farm
 
 
     def elecPrice(self, t, pwr):
         """
         The energy cost on time t
-        threshold get from "Impact of dynamic energy pricing schemes on a novel multi-user home energy management system"
-        price get from "Optimal residential load
-        control with price prediction in real-time electricity pricing environments"
+        pwr can be a number or an array, see power.PowerModel
         """
-        threshold = 1.5
-        if pwr < threshold:
-            p = 5.91 #dynamic price
-        else:
-            p = 8.27
-        return pwr * p
+        return self.power.elecPrice(t, pwr)
 
     def getPwr(self, r, c):
         """
         Implement the energy consumption model
         r: the remain CPU
         c: the total(unit) CPU
-        The parameters' value get from "An energy and deadline aware resource provisioning, scheduling and optimization framework for cloud systems"
+        r and c can be numbers or arrays, see power.PowerModel
         """
-        # eq.2
-        if r < c:
-            pwrS = 1
-        else:
-            pwrS = 0
-        alpha = 0.5 #alpha
-        beta = 10 #beta
-        Ur = (c-r)/c # eq.1
-        if Ur < 0.7:
-            pwrDy = alpha * Ur
-        else:
-            pwrDy = 0.7 * alpha + (Ur - 0.7)**2 * beta
-        return pwrDy+pwrS
+        r = np.asarray(r, dtype=np.float64)
+        return self.power.getPwr(c - r, c)
 
     def rewardFcn1(self):
         """
@@ -291,13 +461,10 @@ class environment(object):
         For stage 1: choose the farm
         """
         # eq.5
-        pwrCFarm = []
-        for i in range(self.farmNum):
-            pwrc = self.getPwr(self.FarmResources[i][0], self.farmOri[i])
-            pwrCFarm.append(pwrc)
-        pwr = sum(pwrCFarm) - sum(self.pwrPFarm)
+        pwrCFarm = self.getPwr(self.cluster.farm[0], np.array(self.farmOri[:self.farmNum]))
+        pwr = pwrCFarm.sum() - np.sum(self.pwrPFarm)
         self.pwrPFarm = pwrCFarm
-        return self.elecPrice(1, pwr)
+        return float(self.elecPrice(self.sim.now, pwr))
 
 #     def EnergyFun(self):
 #         """
@@ -312,53 +479,87 @@ class environment(object):
         """
         Implement the reward function for each server
         For stage 2: choose the server
+        Only the servers in self.changed are recomputed,
+        the others keep their power in self.pwrPre
         """
         # eq.6
-        pwrCur = []
-        for f in self.remainFarm:
-            for s in f:
-                sremain = 0
-                for v in s:
-                    sremain += v[0]
-#                 print(sremain)    
-                pwrc = self.getPwr(sremain, 1.0)
-                if pwrc < 0:
-                    print("here", sremain)
-                pwrCur.append(pwrc)
-#                 print("pwrc", pwrc)
-        pwr = sum(pwrCur) - sum(self.pwrPre)
-        self.totalcost += sum(pwrCur)
-#         print("sum(pwrCur)", sum(pwrCur), "sum(self.pwrPre)", sum(self.pwrPre))
-        self.pwrPre = pwrCur
+        pwr = 0 #change of the total power
+        if len(self.changed) != 0:
+            f, s = np.array(list(self.changed)).T
+            #remaining CPU of the servers, clipped against rounding
+            sremain = np.minimum(self.cluster.cpu[f, s].sum(axis=1), 1.0)
+            pwrc = self.getPwr(sremain, 1.0)
+            if (pwrc < 0).any():
+                print("here", sremain[pwrc < 0])
+            pwr = (pwrc - self.pwrPre[f, s]).sum()
+            self.pwrPre[f, s] = pwrc
+#             print("pwrc", pwrc)
+        self.changed.clear()
+        self.pwrSum += pwr
+        self.totalcost += self.pwrSum
+#         print("sum(pwrCur)", self.pwrSum, "pwr", pwr)
 #         print("pwr",pwr)
 #         print("r2", self.elecPrice(1,pwr))
-        return self.elecPrice(1, pwr)
+        return float(self.elecPrice(self.sim.now, pwr))
 
     def release(self):
         """
         Randomly release resources from each VM
         And set the corresponding task as finished
         """
-        ranFarm = random.randint(0, self.farmNum-1)
-        ranSer = random.randint(0, self.farmOri[ranFarm]-1)
-        ranVM = random.randint(0, self.VMNum-1)
+        ranFarm = self.rng.release.randint(0, self.farmNum-1)
+        ranSer = self.rng.release.randint(0, self.farmOri[ranFarm]-1)
+        ranVM = self.rng.release.randint(0, self.VMNum-1)
         if self.VMtask[ranFarm][ranSer][ranVM]:
-            random.shuffle(self.VMtask[ranFarm][ranSer][ranVM])
-            t = self.VMtask[ranFarm][ranSer][ranVM].pop()
+            vm = list(self.VMtask[ranFarm][ranSer][ranVM])
+            t = vm[self.rng.release.randint(0, len(vm)-1)]
             t.status = 0
-            self.remainFarm[ranFarm][ranSer][ranVM][0] += float(t.CPU)
-            self.remainFarm[ranFarm][ranSer][ranVM][1] += float(t.RAM)
-
-    def releaseByTime(self, farm_i, server_i, vm_j):
-        curtime = time.time()
-        for t in self.VMtask[farm_i][server_i][vm_j]:
-            if t.endtime < curtime:
-                t.status = 0
-                self.remainFarm[farm_i][server_i][vm_j][0] += float(t.CPU)
-                self.remainFarm[farm_i][server_i][vm_j][1] += float(t.RAM)
-                self.FarmResources[farm_i][0] += float(t.CPU)
-                self.FarmResources[farm_i][1] += float(t.RAM)
-                self.VMtask[farm_i][server_i][vm_j].remove(t)
+            self.releaseTask(t, ranFarm, ranSer, ranVM)
+
+    def releaseTask(self, t, farm_i, server_i, vm_j):
+        """
+        Release one finished task from VM with index farm_i, server_i and vm_j
+        Called by the RELEASE event popped from the simulator heap
+        exactly at the task's endtime, so no VM has to be scanned
+        """
+        running = self.VMtask[farm_i][server_i][vm_j]
+        if t not in running:  #already released
+            return
+        running.discard(t)
+        self.cluster.release(farm_i, server_i, vm_j, t)
+        self.changed.add((farm_i, server_i))
+
+    def advance(self):
+        """
+        Jump the simulated clock to the next event instead of polling
+        ARRIVAL: put the ready tasks into the task queue
+        COMPLETION: the running task is finished
+        RELEASE: give the resources of finished tasks back to the VM
+        """
+        if self.dag.reader is not None and self.dag.speedup is not None:
+            self.dag.loadJobs(self.sim.nextTime())
+        self.monitor.tick(self.sim.nextTime())
+        queue = False
+        for kind, data in self.sim.step():
+            if kind == ARRIVAL:
+                if data is not None:  #one task of the trace arrives
+                    self.dag.arrive(data)
+                    self.monitor.arrive(self.sim.now)
+                queue = True
+            elif kind == COMPLETION:
+                data.status = 0
+            elif kind == RELEASE:
+                self.releaseTask(data[0], data[1], data[2], data[3])
+        if queue:
+            self.generateQueue()
+
+    def waitDeadline(self):
+        """
+        Nothing in the queue can be placed and no event is pending, so no
+        VM will free up: jump the clock to the earliest deadline of the
+        queue, where checkRej rejects that task
+        """
+        self.sim.schedule(min(t.ddl for t in self.task), ARRIVAL)
 
     def training(self):
         """
@@ -370,17 +571,34 @@ class environment(object):
         Reject task when R_cpu ≥ C_cpu or R_ram < C_ram
         """
         #send one tesk to dqn and calculate reward
-        self.dag.initTask()
-        self.generateQueue()
+        self.initTraining()
         time_start=time.time()
+        self.trainDQN_v1()
+        time_end=time.time()
+        self.report(time_end-time_start)
+
+    def initTraining(self):
+        """
+        Read the tasks and queue the first ready ones
+        """
+        self.dag.initTask()
+        self.sim.schedule(0, ARRIVAL)
+        self.advance()
+
+    def report(self, timecost):
+        """
+        Keep and print the metrics of one run
+        """
+        self.timecost = round(timecost, 3)
+        self.delay, self.throughput, self.utilization = self.monitor.summary()
         print(self.farmNum, end=' ')
         print(self.severNum, end=' ')
         print(self.num_task, end=' ')
-        self.trainDQN_v1()
-        time_end=time.time()
-        timecost = round(time_end-time_start, 3)
-        print(timecost, end=' ')
+        print(self.rejRate, end=' ')
+        print(self.timecost, end=' ')
         print(round(self.totalcost, 3), end=' ')
+        if self.dag.speedup is not None:
+            print(round(self.delay, 6), round(self.throughput, 3), round(self.utilization, 6), end=' ')
         print()
 
 
@@ -398,15 +616,14 @@ class environment(object):
     def checkRej(self, farm_i, server_i, vm_j, task):
         """
         Check whether this task should be rejected in ith sever, jth VM
-        Reject task when current time + task's runtime > task's ddl
+        Reject task when current simulated time + task's runtime > task's ddl
         """
-        import time
         if task.CPU > 1/self.VMNum or task.RAM > 1/self.VMNum:
             self.rej += 1 
             return -1
-        remain_cpu = self.remainFarm[farm_i][server_i][vm_j][0] - float(task.CPU)
-        remain_ram = self.remainFarm[farm_i][server_i][vm_j][1] - float(task.RAM)
-        curtime = time.time()
+        remain_cpu = self.cluster.cpu[farm_i, server_i, vm_j] - task.CPU
+        remain_ram = self.cluster.ram[farm_i, server_i, vm_j] - task.RAM
+        curtime = self.sim.now
         if curtime + task.runtime <= task.ddl:
             if remain_cpu >= 0 and remain_ram >=0:
                 return 0  # do not reject
@@ -417,20 +634,13 @@ class environment(object):
             return -1  #reject because ddl
 
     def UpdateServerState(self, tempServerFarm, tempSever, vm_numb, task):
-        self.remainFarm[tempServerFarm][tempSever][vm_numb][0] -= float(task.CPU)
-        self.remainFarm[tempServerFarm][tempSever][vm_numb][1] -= float(task.RAM)
-        self.FarmResources[tempServerFarm][0]  -= float(task.CPU)
-        self.FarmResources[tempServerFarm][1] -= float(task.RAM)
-        return self.custom_reshape(self.remainFarm)
-
-    def custom_reshape(self, a):
-        result = []
-        for farNum in a:
-            for serNum in farNum:
-                result.append(serNum)
-        c = np.array(result)
-        d = c.reshape(2 * self.VMNum * self.severNum)
-        return d
+        """
+        Take the task's resources from the chosen VM
+        Return the DQN state, a view into the cluster arrays (no copy)
+        """
+        self.cluster.place(tempServerFarm, tempSever, vm_numb, task)
+        self.changed.add((tempServerFarm, tempSever))
+        return self.cluster.state
     """
     # initialize the DQN stage 2 and environment for it, DQN(intial_state, Num_actions)
         # state = state of all VMs in a server farm
@@ -443,56 +653,152 @@ class environment(object):
      """
 
     def trainDQN_v1(self):
-        rej = 0
+        """
+        Schedule all tasks with the two stage DQN agents
+        """
         self.setFarm()
-        energy = 0
-        input_stage2 = input_stage1 = self.custom_reshape(self.remainFarm)
+        Agent_stage1, Agent_stage2 = self.makeAgents()
+        run = self.runDQN(Agent_stage1, Agent_stage2)
+        state = step(run, None)
+        while state is not None:
+            f = Agent_stage1.processDQN_stage1(state)
+            s = Agent_stage2.processDQN_stage2(state)
+            state = step(run, (f, s))
+
+    def makeAgents(self, **kwargs):
+        """
+        Build the farm (stage 1) and server (stage 2) selection agents
+        kwargs: more Agent options for both
+        """
+        input_stage2 = input_stage1 = self.cluster.state
+        if self.rng.seed is not None:
+            T.manual_seed(int(self.rng.seq.generate_state(1)[0]))  #initial weights
         Agent_stage1 = Agent(lr=0.0001, input_dims=len(input_stage1),
-                             n_actions=self.farmNum)
-        stage1_current_state = input_stage1
+                             n_actions=self.farmNum, rng=self.rng.agent, prioritized=self.prioritized,
+                             target_update=self.target_update, tau=self.tau, double=self.double, **kwargs)
         # input_stage2 = np.array(self.remainFarm[0]).reshape(2*self.VMNum*int(self.severNum/self.farmNum))
         Agent_stage2 = Agent(lr=0.0001, input_dims=len(input_stage2),
-                             n_actions=int(self.severNum/self.farmNum))
-        stage2_current_state = input_stage2
+                             n_actions=int(self.severNum/self.farmNum), rng=self.rng.agent,
+                             prioritized=self.prioritized,
+                             target_update=self.target_update, tau=self.tau, double=self.double, **kwargs)
+        return Agent_stage1, Agent_stage2
+
+    def runDQN(self, Agent_stage1, Agent_stage2):
+        """
+        The scheduling loop as a generator: it yields the state whenever
+        a ready task needs a farm and a server, and gets the actions
+        (farm, server) back by send()
+        The agents learn from the placements here, the actions are chosen
+        by the caller: trainDQN_v1 for one environment or VecEnvironment
+        for many in lockstep
+        """
+        rej = 0
+        energy = 0
         acc = 0
-        while len(self.task) != 0:
+        while len(self.task) != 0 or self.dag.waiting != 0:
 #             print(len(self.task))
             while len(self.task) != 0:
+                progress = False
+                done = set()  #removed from the queue in bulk after the pass
                 for t in self.task:
-                    if t.status == -1: #rejected
-                        self.dag.updateStatus(t)
-                        self.task.remove(t)
-                    elif t.status == 1:   #ready 
-                        f = stage1_action = Agent_stage1.processDQN_stage1(stage1_current_state)
-                        s = stage2_action = Agent_stage2.processDQN_stage2(stage2_current_state)
-                        vm = random.randint(0,self.VMNum-1)
-                        self.releaseByTime(f, s, vm)  # release by time
+                    if t.status == 1:   #ready 
+                        stage1_action, stage2_action = yield self.cluster.state
+                        f, s = stage1_action, stage2_action
+                        vm = self.rng.vm.randint(0, self.VMNum-1)
                         rej = self.checkRej(f, s, vm, t)
                         if rej == -1:  #rejected due to ddl
                             t.status = -1
+                            done |= self.dag.updateStatus(t)
+                            progress = True
                         # if not reject:
                         elif rej == 0:
-                            t.endtime = time.time() + t.runtime
+                            t.endtime = self.sim.now + t.runtime
+                            self.sim.schedule(t.endtime, COMPLETION, t)
+                            self.sim.schedule(t.endtime, RELEASE, [t, f, s, vm])
+                            np.copyto(self.statePre, self.cluster.state)
+                            stage1_current_state = stage2_current_state = self.statePre
                             stage1_next_state = stage2_next_state = self.UpdateServerState(f, s, vm, t)
 #                             print(self.remainFarm)
                             reward_stage2 = self.rewardFcn2()
                             energy += reward_stage2
                             Agent_stage2.learn(stage2_current_state, stage2_action, reward_stage2, stage2_next_state)
-                            stage2_current_state = stage2_next_state
                             reward_stage1 = self.rewardFcn1()
                             Agent_stage1.learn(stage1_current_state, stage1_action, reward_stage1, stage1_next_state)
-                            stage1_current_state = stage1_next_state
-                            self.VMtask[f][s][vm].append(t)
+                            self.VMtask[f][s][vm].add(t)
                             t.status = 2
+                            self.monitor.place(t, self.sim.now)
+                            self.dag.resolve(t)
 #                             self.dag.updateStatus(t)
-                            self.task.remove(t)
+                            done.add(t)
                             acc += 1
+                            progress = True
 #                         else:
 #                             t.status = -1
 #                             rej += 1
+                if len(done) != 0:
+                    self.task[:] = [t for t in self.task if t not in done]  #in place, shared with dag.task
+                if not progress:  #chosen VMs are busy, wait for the next event
+                    if self.sim.empty():
+                        self.waitDeadline()
+                    self.advance()
             self.generateQueue()
+            if len(self.task) == 0 and self.dag.waiting != 0:
+                self.advance()  #nothing queued, wait for the next arrival
         # print("total number of tasks: {0}, rejected tasks: {1}".format(len(self.task), rej))
-        print(round(1 - acc/self.num_task, 3), end= ' ')
+        self.rejRate = round(1 - acc/self.num_task, 3)
+
+
+def step(run, action):
+    """
+    Send the actions to a runDQN generator
+    Return the next state, None when all its tasks are done
+    """
+    try:
+        return run.send(action)
+    except StopIteration:
+        return None
+
+
+class VecEnvironment(object):
+    """
+    K environments of the same scale and number of servers, stepped in lockstep
+    The two stage agents are shared: each round takes one decision in every
+    environment that still has tasks, with one batched forward pass per agent
+    over their [K, state_dim] states, and all transitions go to the same replay buffers
+    e.g. VecEnvironment([environment('small', f, 1000, 100, seed=i) for i in range(8)])
+    """
+    def __init__(self, envs):
+        self.envs = envs
+        self.num_task = sum(e.num_task for e in envs)
+        for e in envs:
+            if (e.scale, e.severNum) != (envs[0].scale, envs[0].severNum):
+                raise ValueError("all environments need the same scale and number of servers")
+
+    def training(self):
+        for e in self.envs:
+            e.initTraining()
+        time_start = time.time()
+        for e in self.envs:
+            e.setFarm()
+        Agent_stage1, Agent_stage2 = self.envs[0].makeAgents()
+        for agent in (Agent_stage1, Agent_stage2):
+            agent.learn_every *= len(self.envs)  #updates per round as with one environment
+        runs = [e.runDQN(Agent_stage1, Agent_stage2) for e in self.envs]
+        states = [step(run, None) for run in runs]
+        live = [i for i in range(len(runs)) if states[i] is not None]
+        while len(live) != 0:
+            batch = np.stack([states[i] for i in live])
+            f = Agent_stage1.choose_actions(batch)
+            s = Agent_stage2.choose_actions(batch)
+            for j, i in enumerate(live):
+                states[i] = step(runs[i], (int(f[j]), int(s[j])))
+            live = [i for i in live if states[i] is not None]
+        time_end = time.time()
+        for e in self.envs:
+            e.report(time_end - time_start)
+        self.timecost = round(time_end - time_start, 3)
+        self.totalcost = sum(e.totalcost for e in self.envs)
 
-p1 = environment('small', 'output_5000.txt', 5000, 300)
-p1.training()
+if __name__ == '__main__':
+    p1 = environment('small', 'output_5000.txt', 5000, 300)
+    p1.training()
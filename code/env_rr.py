@@ -10,6 +10,15 @@
 # the reject rate and run time                        #
 #######################################################
 
+import numpy as np
+from collections import deque
+from sys import intern
+from simulator import Simulator, Monitor, ARRIVAL, COMPLETION, RELEASE
+from cluster import Cluster, firstFit
+from power import PowerModel
+from tracefile import openTrace, isTrace
+from rng import Streams
+
 
 class Task(object):   
     """
@@ -18,9 +27,11 @@ class Task(object):
     jobID, index, CPU, RAM, disk extracted from user data
     status indicates the current status of the task
     """
+    __slots__ = ('parent', 'child', 'jobID', 'index', 'CPU', 'RAM', 'disk',
+                 'status', 'runtime', 'ddl', 'endtime', 'pending', 'seq',
+                 'arrival', 'link')  #no __dict__ per task
+
     def __init__(self, jobID, index, CPU, RAM, disk, status):
-        import random
-        import time
         self.parent = []
         self.child = []
         self.jobID = jobID
@@ -29,80 +40,167 @@ class Task(object):
         self.RAM = RAM
         self.disk = disk
         self.status = status  #-1: rejected, 0: finished, 1: ready, 2: running
-        self.runtime = random.randint(1, 10)/1000.0
-        self.ddl = time.time() + self.runtime + random.randint(10, 1000)/200.0
+        self.runtime = 0.0  #runtime and ddl are drawn job by job, see DAG.initTasks
+        self.ddl = 0.0
         self.endtime = 0
+        self.pending = 0  #number of parents still waiting (status 1)
+        self.seq = 0  #position in the input file
+        self.arrival = 0.0  #simulated time the task arrives
+        self.link = None  #position of the parent in the job given by the trace, -1: none
         
 class DAG(object):
     """
     Transform job queue to task ready queue
     """
-    def __init__(self, fname, num_task):
+    def __init__(self, fname, num_task, window=None, speedup=None, rng=None):
         self.fname = fname
+        self.rng = rng if rng is not None else Streams()  #random streams of the run
         self.num_task = num_task
+        self.speedup = speedup  #replay trace timestamps this many times faster, None puts all tasks at 0
+        self.sim = None  #simulator of the environment, for the arrival events
+        self.monitor = None  #monitor of the environment, for the arrival times
+        self.waiting = 0  #tasks read but not arrived yet
+        self.window = window  #lookahead in queued tasks, None reads all jobs first
+        self.reader = None
+        self.peek = None  #next job of the reader, read but not loaded
         self.job = []
         self.task = []
+        self.ready = deque()  #tasks whose parents are all finished
     
-    def readfile(self):
+    def readJobs(self):
         """
-        Read the input job file
+        Read the input job file lazily, yield one job (list of tasks) at a time
         All task are initialized to ready status
+        fname can also be a binary trace made by tracefile.py
+        or a Trace from workload.py
         """
         num_task = 0
+        if isTrace(self.fname):
+            for rows in openTrace(self.fname).jobs(self.num_task):
+                task = []
+                stamps = []
+                for jobID, index, CPU, RAM, disk, timestamp, link in rows:
+                    task.append(Task(jobID, index, CPU, RAM, disk, 1))
+                    task[-1].link = link
+                    task[-1].seq = num_task
+                    stamps.append(timestamp)
+                    num_task += 1
+                self.initTasks(task, stamps)
+                yield task
+            return
         with open(self.fname, 'r') as f:
-            task = []            
+            task = []
+            stamps = []            
             for line in f:
                 if line[0] == 'J':
                     if len(task) != 0:
-                        self.job.append(task)
+                        self.initTasks(task, stamps)
+                        yield task
                         task = []
+                        stamps = []
                 else:
                     info = list(line.strip(' ').split())
-                    task.append(Task(info[1], info[2], float(info[4]), float(info[5]), info[6], 1))
+                    #ids repeat a lot, keep one string object for each
+                    task.append(Task(intern(info[1]), intern(info[2]), float(info[4]), float(info[5]), float(info[6]), 1))
+                    if len(info) > 7:  #parent column of synthetic.py
+                        task[-1].link = int(info[7])
+                    task[-1].seq = num_task
+                    stamps.append(float(info[0]))
                     num_task += 1
                 if num_task == self.num_task: 
                     break
             if len(task) != 0:
-                self.job.append(task)
-    
-    def checkRing(self, parent, child): 
+                self.initTasks(task, stamps)
+                yield task
+
+    def initTasks(self, task, timestamp):
+        """
+        Draw the runtime and ddl of all tasks of one job at once
+        In replay mode the task arrives at its trace timestamp
+        (microseconds) divided by speedup, its ddl moves with it
+        """
+        runtime = self.rng.task.randints(1, 10, len(task)) / 1000.0
+        ddl = runtime + self.rng.task.randints(10, 1000, len(task)) / 200.0
+        if self.speedup is not None:
+            arrival = np.asarray(timestamp, dtype=np.float64) / 1e6 / self.speedup
+            ddl += arrival
+            for t, a in zip(task, arrival.tolist()):
+                t.arrival = a
+        for t, r, d in zip(task, runtime.tolist(), ddl.tolist()):
+            t.runtime = r
+            t.ddl = d
+
+    def readfile(self):
         """
-        Check whether there is a loop between parent and child
-        Return True if has loop
+        Read the whole input job file
+        All task are initialized to ready status
         """
-        if parent.index == child.index:
-            return True
-        if len(child.child) == 0:
-            return False
-        for c in child.child:
-            if self.checkRing(parent, c):
-                return True
-        return False
-    
-    
+        for job in self.readJobs():
+            self.job.append(job)
+
+    def findRoot(self, root, k):
+        """
+        Find the root of the tree that task k is in
+        root: union-find parent of each task position in the job
+        Iterative with path halving, no recursion
+        """
+        while root[k] != k:
+            root[k] = root[root[k]]
+            k = root[k]
+        return k
+
     def buildDAG(self):
         """
         Randomly build dependencies between tasks within each job
+        Each task gets at most one parent, so every job is a forest
+        and a task is still a tree root when its own parent is drawn
+        The edge parent -> task makes a loop only if parent is in the
+        tree of task, so it is checked with union-find in near constant
+        time instead of walking all children of task
+        Jobs whose trace has a parent column (see synthetic.py)
+        keep the dependencies given there
         """
-        import random
         for job in self.job:           
-            for task in job:
-                i = random.randint(-len(job), len(job) - 1)
+            if len(job) != 0 and job[0].link is not None:
+                for task in job:
+                    if task.link >= 0:
+                        parent = job[task.link]
+                        task.parent.append(parent)
+                        parent.child.append(task)
+                continue
+            root = list(range(len(job)))
+            draw = self.rng.dag.randints(-len(job), len(job) - 1, len(job)).tolist()
+            for k in range(len(job)):
+                task = job[k]
+                i = draw[k]
                 if i < 0:
                     continue
                 parent = job[i]
-                if self.checkRing(parent, task) == False:
+                r = self.findRoot(root, i)
+                if r != k:  #no loop
                     task.parent.append(parent)
                     parent.child.append(task)
-    
+                    root[k] = r
+
     def rejTask(self, task):
         """
         If one task is rejected
         Then all tasks that depended on this task will be rejected
-        """
-        task.status = -1
-        for c in task.child:
-            self.rejTask(c)
+        Walk the child tasks with a stack, each task is visited once
+        Return the set of tasks rejected by this call
+        """
+        rejected = {task}
+        stack = [task]
+        while len(stack) != 0:
+            t = stack.pop()
+            if t.status == 1:
+                self.resolve(t)
+            t.status = -1
+            for c in t.child:
+                if c not in rejected:
+                    rejected.add(c)
+                    stack.append(c)
+        return rejected
     
     def hasParent(self, task):
         """
@@ -119,6 +217,7 @@ class DAG(object):
         Given jobid and taskid, change status of all tasks that depend on it
         If the task with "-1" status, reject this tasks' all child tasks
         If the task with "0" status, remove it from all child tasks
+        Return the set of rejected tasks
         """
 #         job_i, task_i = self.findTask(task.jobID, task.index)
 #         if job_i == -1 or task_i == -1:
@@ -127,29 +226,113 @@ class DAG(object):
 #         job = self.job[job_i]
 #         task = job[task_i]
         if task.status == -1:
-            self.rejTask(task)
+            return self.rejTask(task)
+        return set()
 #         elif task.status == 0:
 #             self.rmParent(task, task_i, job)
     
     def initTask(self):
         """
         run readfile and buildDAG functions
+        With a lookahead window the jobs are read later by loadJobs()
         """
+        if self.window is not None:
+            self.reader = self.readJobs()
+            return
         self.readfile()
         self.buildDAG()
+        self.buildQueue()
+
+    def loadJobs(self, horizon=None):
+        """
+        Read jobs one by one until window tasks are queued (or not arrived yet)
+        or the file ends, build the DAG of each new job
+        and put its ready tasks to the ready deque
+        horizon: in replay mode every job that arrives before it is read too,
+        so the clock never passes an arrival that is not read yet
+        (the jobs should be in arrival order, see workload.py --arrival)
+        """
+        while self.reader is not None:
+            if self.peek is None:
+                self.peek = next(self.reader, None)
+                if self.peek is None:
+                    self.reader = None
+                    break
+            due = horizon is not None and min(t.arrival for t in self.peek) <= horizon
+            if not due and len(self.ready) + len(self.task) + self.waiting >= self.window:
+                break
+            job, self.peek = self.peek, None
+            self.job = [job]  #done jobs are not kept
+            self.buildDAG()
+            self.buildQueue()
+
+    def buildQueue(self):
+        """
+        Count the waiting parents of each task
+        and put the tasks without waiting parent to the ready deque
+        Run once, then the deque is kept by resolve()
+        """
+        for job in self.job:
+            for task in job:
+                task.pending = 0
+                for p in task.parent:
+                    if p.status == 1:
+                        task.pending += 1
+                self.waitArrival(task)
+                if task.status == 1 and task.pending == 0:
+                    self.ready.append(task)
+
+    def waitArrival(self, task):
+        """
+        A task that has not arrived waits for its ARRIVAL event
+        like for one more parent
+        """
+        if self.speedup is not None and task.arrival > self.sim.now:
+            task.pending += 1
+            self.waiting += 1
+            self.sim.schedule(task.arrival, ARRIVAL, task)
+        elif self.speedup is not None and self.monitor is not None:
+            self.monitor.arrive(task.arrival)  #already arrived, no event
+
+    def arrive(self, task):
+        """
+        Called by the ARRIVAL event of one task
+        """
+        self.waiting -= 1
+        task.pending -= 1
+        if task.pending == 0 and task.status == 1:
+            self.ready.append(task)
+
+    def resolve(self, task):
+        """
+        Called once when a task leaves status 1 (running or rejected)
+        A child becomes ready when its last waiting parent is resolved
+        """
+        for c in task.child:
+            c.pending -= 1
+            if c.pending == 0 and c.status == 1:
+                self.ready.append(c)
     
     def taskQueue(self): 
         """
         Build the task ready queue
         Just put the one whose status is 1 
         and whose parent are all finished
-        """
-        for job in self.job:
+        The ready deque is filled by resolve(), so no task is scanned
+        Tasks are queued in file order, the same as scanning all jobs
+        """
+        if self.reader is not None:
+            self.loadJobs()
+        batch = [t for t in self.ready if t.status == 1]  #may be rejected while waiting
+        self.ready.clear()
+        batch.sort(key=lambda t: t.seq)
+        self.task.extend(batch)
+#         for job in self.job:
 #             num_task = len(job)
 #             while num_task > 0:
-            for task in job:
-                if task.status == 1 and self.hasParent(task) == False:
-                    self.task.append(task)
+#             for task in job:
+#                 if task.status == 1 and self.hasParent(task) == False:
+#                     self.task.append(task)
 #                     task.status = 0
 #                     self.updateStatus(task)
 #                     num_task -= 1
@@ -173,7 +356,7 @@ class environment(object):
     calculate the Reward Function
     interface with DQN and baseline
     """
-    def __init__(self, scale, fname, num_task, num_server):
+    def __init__(self, scale, fname, num_task, num_server, window=None, speedup=None, seed=None):
         """
         initial the variable
         We assume each server has 10 VM
@@ -188,12 +371,18 @@ class environment(object):
         self.scale = scale
         self.fname = fname
         self.task = []
-        self.dag = DAG(self.fname, num_task)
+        self.rng = Streams(seed)  #seed None: fresh entropy
+        self.dag = DAG(self.fname, num_task, window, speedup, self.rng)
         self.VMNum = 2
         self.rej = 0
         self.num_task = num_task
         self.severNum = num_server
         self.totalcost = 0
+        self.sim = Simulator()
+        self.dag.sim = self.sim
+        self.monitor = Monitor()
+        self.dag.monitor = self.monitor
+        self.power = PowerModel()
         if self.scale == 'small':
 #             self.severNum = 200
             self.farmNum = 10
@@ -210,10 +399,15 @@ class environment(object):
         Set the initial values for each server and Vms
         Each server has unit CPU, RAM, and local disk space
         Each VM has 1/n unit CPU and RAM
-        """
-        self.severs = [[1,1,1]for _ in range(self.severNum)]
-        self.VM = [[[1.0/self.VMNum, 1.0/self.VMNum]for _ in range(self.VMNum)]for _ in range(self.severNum)]
-        self.VMtask = [[[]for _ in range(self.VMNum)]for _ in range(self.severNum)]
+        RR does not place by farm, so all servers are kept in one farm of the cluster
+        VMcpu and VMram are [server, VM] views into the cluster arrays
+        """
+        self.severs = np.ones((self.severNum, 3))
+        self.cluster = Cluster(1, self.severNum, self.VMNum)
+        self.monitor.watch(self.cluster)
+        self.VMcpu = self.cluster.cpu[0]
+        self.VMram = self.cluster.ram[0]
+        self.VMtask = [[set()for _ in range(self.VMNum)]for _ in range(self.severNum)]
 #         print(self.num_task, "requests")
 
     def generateQueue(self):
@@ -230,54 +424,36 @@ class environment(object):
         Each farm has at least 1 server and at most 2*m/n-1 servers
         Initial power usage for each servers and each farm
         """
-        import random
         self.farmOri = []
         m = self.severNum
         n = self.farmNum
         for _ in range(self.farmNum-1):
-            f = random.randint(0,int(2*m/n))
+            f = self.rng.farm.randint(0, int(2*m/n))
             m -= f
             n -= 1
             self.farmOri.append(f)
         self.farmOri.append(m)
-        self.pwrPre = [0]*self.severNum #power usage pre sever
-        self.pwrPFarm = [0]*self.farmNum #power usage per farm
+        self.pwrPre = np.zeros(self.severNum) #power usage pre sever
+        self.pwrSum = 0.0 #running total of pwrPre
+        self.changed = set() #servers whose utilization changed since the last reward
+        self.pwrPFarm = np.zeros(self.farmNum) #power usage per farm
 #         print (self.farmOri)
 
     def elecPrice(self, t, pwr):
         """
         The energy cost on time t
-        threshold get from "Impact of dynamic energy pricing schemes on a novel multi-user home energy management system"
-        price get from "Optimal residential load
-        control with price prediction in real-time electricity pricing environ- ments"
+        pwr can be a number or an array, see power.PowerModel
         """
-        threshold = 1.5
-        if pwr < threshold:
-            p = 5.91 #dynamic price
-        else:
-            p = 8.27
-        return pwr * p
+        return self.power.elecPrice(t, pwr)
 
     def getPwr(self, r, c):
         """
         Implement the energy consumption model
         r: the requires CPU
         c: the total(unit) CPU
-        The parameters' value get from "An energy and deadline aware resource provisioning, scheduling and optimization framework for cloud systems"
+        r and c can be numbers or arrays, see power.PowerModel
         """
-        # eq.2
-        if r > 0:
-            pwrS = 1
-        else:
-            pwrS = 0
-        alpha = 0.5 #alpha
-        beta = 10 #beta
-        Ur = r/c # eq.1
-        if Ur < 0.7:
-            pwrDy = alpha * Ur
-        else:
-            pwrDy = 0.7 * alpha + (Ur - 0.7)**2 * beta
-        return pwrDy+pwrS
+        return self.power.getPwr(r, c)
 
     def rewardFcn1(self, f, t):
         """
@@ -285,57 +461,78 @@ class environment(object):
         For stage 1: choose the farm
         """
         # eq.5
-        pwrCFarm = []
-        for i in range(len(self.farmOri)):
-            if i == f:
-                self.pwrPFarm[i] += t
-            pwrc = self.getPwr(self.pwrPFarm[i], self.farmOri[i])
-            pwrCFarm.append(pwrc)
-        pwr = sum(pwrCFarm) - sum(self.pwrPFarm)
+        self.pwrPFarm[f] += t
+        pwrCFarm = self.getPwr(self.pwrPFarm, np.array(self.farmOri))
+        pwr = pwrCFarm.sum() - self.pwrPFarm.sum()
         self.pwrPFarm = pwrCFarm
-        print (self.elecPrice(1, pwr))
+        print (self.elecPrice(self.sim.now, pwr))
 
     def rewardFcn2(self):
         """
         Implement the reward function for each server
         For stage 2: choose the server
+        Only the servers in self.changed are recomputed,
+        the others keep their power in self.pwrPre
         """
         # eq.6
-        pwrCur = []
-        for m in self.severs:
-            pwrc = self.getPwr(1-m[-3], 1)
-            pwrCur.append(pwrc)
+        pwr = 0 #change of the total power
+        if len(self.changed) != 0:
+            s = np.fromiter(self.changed, dtype=np.int64, count=len(self.changed))
+            pwrc = self.getPwr(1-self.severs[s, -3], 1)
+            pwr = (pwrc - self.pwrPre[s]).sum()
+            self.pwrPre[s] = pwrc
 #             print("pwrc", pwrc)
-        pwr = sum(pwrCur) - sum(self.pwrPre)
-        self.totalcost += sum(pwrCur)
-#         print("sum(pwrCur)", sum(pwrCur), "sum(self.pwrPre)", sum(self.pwrPre))
-        self.pwrPre = pwrCur
+        self.changed.clear()
+        self.pwrSum += pwr
+        self.totalcost += self.pwrSum
+#         print("sum(pwrCur)", self.pwrSum, "pwr", pwr)
 #         print("pwr",pwr)
 #         print ("energy cost: ", round(self.elecPrice(1, pwr), 3))
 
-    def releaseByTime(self, server_i, vm_j):
+    def releaseTask(self, t, server_i, vm_j):
         """
-        Release tasks in VM with index server_i and vm_j
-        If task's endtime < current time, this task can be released
+        Release one finished task from VM with index server_i and vm_j
+        Called by the RELEASE event popped from the simulator heap
+        exactly at the task's endtime, so no VM has to be scanned
         """
-        import time
-        curtime = time.time()
-        for t in self.VMtask[server_i][vm_j]:
-            if t.endtime < curtime:
-                t.status = 0
-#                 print(t.ddl, t.runtime, t.endtime, curtime)
-                self.VM[server_i][vm_j][0] += float(t.CPU)
-                self.VM[server_i][vm_j][1] += float(t.RAM)
-                self.VMtask[server_i][vm_j].remove(t)
-#                 for c in t.child:
-#                     count = 0
-#                     for p in c.parent:
-#                         if p == 0:
-#                             count += 1
-#                     if count == len(c.parent):
-#                         self.task.append(c)
-                        
-                
+        running = self.VMtask[server_i][vm_j]
+        if t not in running:  #already released
+            return
+        running.discard(t)
+        self.cluster.release(0, server_i, vm_j, t)
+
+    def advance(self):
+        """
+        Jump the simulated clock to the next event instead of polling
+        ARRIVAL: put the ready tasks into the task queue
+        COMPLETION: the running task is finished
+        RELEASE: give the resources of finished tasks back to the VM
+        """
+        if self.dag.reader is not None and self.dag.speedup is not None:
+            self.dag.loadJobs(self.sim.nextTime())
+        self.monitor.tick(self.sim.nextTime())
+        queue = False
+        for kind, data in self.sim.step():
+            if kind == ARRIVAL:
+                if data is not None:  #one task of the trace arrives
+                    self.dag.arrive(data)
+                    self.monitor.arrive(self.sim.now)
+                queue = True
+            elif kind == COMPLETION:
+                data.status = 0
+            elif kind == RELEASE:
+                self.releaseTask(data[0], data[1], data[2])
+        if queue:
+            self.generateQueue()
+
+    def waitDeadline(self):
+        """
+        Nothing in the queue can be placed and no event is pending, so no
+        VM will free up: jump the clock to the earliest deadline of the
+        queue, where checkRej rejects that task
+        """
+        self.sim.schedule(min(t.ddl for t in self.task), ARRIVAL)
+
     def training(self):
         """
         Run the RR baseline in the  environment
@@ -345,31 +542,35 @@ class environment(object):
         #send one tesk to dqn and calculate reward
 #         print(self.severNum, "servers", end=' ')
         self.dag.initTask()
-        self.generateQueue()
+        self.sim.schedule(0, ARRIVAL)
+        self.advance()
         self.setFarm()
         import time
         time_start=time.time()
         self.RR()
         time_end=time.time()
         timecost = round(time_end-time_start, 3)
+        self.timecost = timecost
+        self.delay, self.throughput, self.utilization = self.monitor.summary()
 #         print('Time cost', timecost,'s', end=' ')
 #         print('cost', self.totalcost)
         print(timecost, end=' ')
         print(round(self.totalcost, 3), end=' ')
+        if self.dag.speedup is not None:
+            print(round(self.delay, 6), round(self.throughput, 3), round(self.utilization, 6), end=' ')
         print()
 
     def checkRej(self, server_i, vm_j, task):
         """
         Check whether this task should be rejected in ith sever, jth VM
-        Reject task when current time + task's runtime > task's ddl
+        Reject task when current simulated time + task's runtime > task's ddl
         """
-        import time
         if task.CPU > 1/self.VMNum or task.RAM > 1/self.VMNum:
             self.rej += 1 
             return -1
-        remain_cpu = self.VM[server_i][vm_j][0] - float(task.CPU)
-        remain_ram = self.VM[server_i][vm_j][1] - float(task.RAM)
-        curtime = time.time()
+        remain_cpu = float(self.VMcpu[server_i, vm_j]) - task.CPU
+        remain_ram = float(self.VMram[server_i, vm_j]) - task.RAM
+        curtime = self.sim.now
         if curtime + task.runtime <= task.ddl:
             if remain_cpu >= 0 and remain_ram >=0:
                 return 0  # do not reject
@@ -378,6 +579,17 @@ class environment(object):
         else:
             self.rej += 1 
             return -1  #reject because ddl
+
+    def searchRR(self, t, i):
+        """
+        Find the server and VM for task t, starting from server i
+        All servers are checked in one batched array operation
+        The original server by server loop only ever checked the first VM
+        of each server, so only that VM is searched to keep its decisions
+        (test_rr_search.py compares both on output_5000.txt)
+        Return (server_i, vm_j), or (-1, -1) if no VM fits
+        """
+        return firstFit(self.VMcpu[:, :1], self.VMram[:, :1], t, i)
         
     def RR(self):
         """
@@ -387,64 +599,60 @@ class environment(object):
         """
         i = 0 #no.sever 
         acc = 0
-        while len(self.task) != 0:
+        while len(self.task) != 0 or self.dag.waiting != 0:
             #assign all tasks in current queue
             
             while len(self.task) != 0:
 #                 print(len(self.task))
+                progress = False
+                done = set()  #removed from the queue in bulk after the pass
                 for t in self.task:
 #                     print(t.jobID, t.index, t.status)
-                    if t.status == -1: #rejected
-                        self.dag.updateStatus(t)
-                        self.task.remove(t)
-                    elif t.status == 1:   #ready           
-                        server_pass = 0
-                        server_i = i 
-                        vm_j = 0
-                        #find which server
-                        self.releaseByTime(server_i, vm_j)
-                        rej = self.checkRej(server_i, vm_j, t)
+                    if t.status == 1:   #ready           
+                        server_i = vm_j = -1
+                        rej = self.checkRej(i, 0, t)
                         if rej == -1:  #rejected due to ddl
                             t.status = -1
-                        while rej != 0 and server_pass <= self.severNum and t.status == 1: 
-                            rej = self.checkRej(server_i, vm_j, t)
-                            #find which VM
-                            while vm_j < len(self.VM[server_i]) and rej != 0 and t.status == 1:
-                                if rej == -1:  #rejected due to ddl
-                                    t.status = -1
-                                self.releaseByTime(server_i, vm_j)
-                                vm_j += 1
-                            if vm_j == len(self.VM[server_i]):  #this server not meet the requirement
-                                server_pass += 1
-                                vm_j = 0
-                                server_i += 1  #go to next server
-                            else:
-                                break
-                            if server_i == self.severNum:
-                                server_i = 0       
-                            rej = self.checkRej(server_i, vm_j, t)
-                        if server_pass <= self.severNum and vm_j < len(self.VM[server_i]) and t.status == 1:
+                            done |= self.dag.updateStatus(t)
+                            progress = True
+                        else:
+                            #find which server and VM
+                            server_i, vm_j = self.searchRR(t, i)
+                        if server_i != -1 and t.status == 1:
                             #arrange task to server_i, vm_j VM
                             decision = [server_i, vm_j]
     #                             print(server_i, vm_j)
-                            self.VMtask[decision[0]][decision[1]].append(t)
-                            self.VM[decision[0]][decision[1]][0] -= float(t.CPU)
-                            self.VM[decision[0]][decision[1]][1] -= float(t.RAM)
-                            self.severs[decision[0]][0] -= float(t.CPU)  
-                            self.severs[decision[0]][1] -= float(t.RAM) 
-                            import time
-                            curtime = time.time()
-                            t.endtime = curtime + t.runtime
+                            self.VMtask[decision[0]][decision[1]].add(t)
+                            self.cluster.place(0, decision[0], decision[1], t)
+                            self.severs[decision[0]][0] -= t.CPU
+                            self.severs[decision[0]][1] -= t.RAM
+                            self.changed.add(decision[0])
+                            t.endtime = self.sim.now + t.runtime
+                            self.sim.schedule(t.endtime, COMPLETION, t)
+                            self.sim.schedule(t.endtime, RELEASE, [t, server_i, vm_j])
                             i += 1
                             if i == self.severNum:
                                 i = 0
                             t.status = 2  #set statue to running
-                            self.task.remove(t)   
+                            self.monitor.place(t, self.sim.now)
+                            self.dag.resolve(t)
+                            done.add(t)
                             self.rewardFcn2()
                             acc += 1
+                            progress = True
 #                             print(acc)
+                if len(done) != 0:
+                    self.task[:] = [t for t in self.task if t not in done]  #in place, shared with dag.task
+                if not progress:  #all VMs are busy, wait for the next event
+                    if self.sim.empty():
+                        self.waitDeadline()
+                    self.advance()
             self.generateQueue()
-        print(round(1 - acc / self.num_task, 3), end=' ') 
+            if len(self.task) == 0 and self.dag.waiting != 0:
+                self.advance()  #nothing queued, wait for the next arrival
+        self.rejRate = round(1 - acc / self.num_task, 3)
+        print(self.rejRate, end=' ') 
         
-p1 = environment('small', 'output_5000.txt', 1000, 100)
-p1.training()
\ No newline at end of file
+if __name__ == '__main__':
+    p1 = environment('small', 'output_5000.txt', 1000, 100)
+    p1.training()
\ No newline at end of file
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#######################################################
+# energy consumption and electricity price model      #
+# of RP/TS processor, evaluated on whole arrays of    #
+# servers or farms with np.where                      #
+#######################################################
+
+import numpy as np
+
+
+class PowerModel(object):
+    """
+    Vectorized power and price model
+    Every method takes scalars or arrays and works element-wise
+    alpha, beta, knee: parameters of the energy consumption model (eq.2)
+    threshold, low, high: dynamic price, low price below the power threshold
+    curve: optional time-of-day price, 24 hourly factors of the price
+    """
+    def __init__(self, alpha=0.5, beta=10, knee=0.7, threshold=1.5,
+                 low=5.91, high=8.27, curve=None):
+        self.alpha = alpha
+        self.beta = beta
+        self.knee = knee
+        self.threshold = threshold
+        self.low = low
+        self.high = high
+        self.curve = None if curve is None else np.asarray(curve, dtype=np.float64)
+
+    def getPwr(self, r, c):
+        """
+        Implement the energy consumption model
+        r: the requires CPU
+        c: the total(unit) CPU
+        The parameters' value get from "An energy and deadline aware resource provisioning, scheduling and optimization framework for cloud systems"
+        """
+        r = np.asarray(r, dtype=np.float64)
+        # eq.2
+        pwrS = np.where(r > 0, 1.0, 0.0)
+        Ur = r / c # eq.1
+        pwrDy = np.where(Ur < self.knee, self.alpha * Ur,
+                         self.knee * self.alpha + (Ur - self.knee)**2 * self.beta)
+        return pwrDy + pwrS
+
+    def elecPrice(self, t, pwr):
+        """
+        The energy cost on time t
+        threshold get from "Impact of dynamic energy pricing schemes on a novel multi-user home energy management system"
+        price get from "Optimal residential load
+        control with price prediction in real-time electricity pricing environments"
+        t is the simulated time in seconds, only used by the time-of-day curve
+        """
+        pwr = np.asarray(pwr, dtype=np.float64)
+        p = np.where(pwr < self.threshold, self.low, self.high) #dynamic price
+        if self.curve is not None:
+            hour = (np.asarray(t) // 3600).astype(np.int64) % len(self.curve)
+            p = p * self.curve[hour]
+        return pwr * p
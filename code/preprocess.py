@@ -1,18 +1,121 @@
 # -*- coding: utf-8 -*-
-import gzip
-import csv
+import os
+import glob
+import heapq
+import argparse
+import tempfile
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
-data1 = pd.read_csv("part-00000-of-00500.csv.gz.csv",compression='gzip',error_bad_lines=False,header=None) #read the data from .gz file
-data2 = pd.read_csv("part-00001-of-00500.csv.gz.csv",compression='gzip',error_bad_lines=False,header=None)
-data = data1.append(data2) #connect the files
-print(data1.shape)
-print(data2.shape)
-print(data.shape)
-data.columns = ["timestamp","missinginfo","jobID","taskindex​-withinthejob","machineID","eventtype","username","schedulingclass","priority","CPU","RAM","local disk space","different-machine-constraint"]
+
 #corresponding columns name: we find them from google cluster' doc
-data = data.drop(["missinginfo","machineID","eventtype","username","schedulingclass","different-machine-constraint"],axis = 1)
-#we drop some columns that are not related to our goal
-data = data[(~data["CPU"].isin(["NaN"]))&(~data["RAM"].isin(["NaN"]))&(~data["local disk space"].isin(["NaN"]))] #drop the missing data
-np.savetxt("input.txt",data.values, fmt='%s')
-print(list(data))
\ No newline at end of file
+COLUMNS = ["timestamp","missinginfo","jobID","taskindex​-withinthejob","machineID","eventtype","username","schedulingclass","priority","CPU","RAM","local disk space","different-machine-constraint"]
+#we only read the columns that are related to our goal, the others are dropped by the parser
+KEEP = ["timestamp","jobID","taskindex​-withinthejob","priority","CPU","RAM","local disk space"]
+DTYPES = {"timestamp": np.int64, "jobID": np.int64, "taskindex​-withinthejob": np.int32,
+          "priority": np.int8, "CPU": np.float64, "RAM": np.float64, "local disk space": np.float64}
+SHARDS = ["part-00000-of-00500.csv.gz.csv", "part-00001-of-00500.csv.gz.csv"]
+
+
+def readShard(fname, chunksize=100000):
+    """
+    Read one task-event shard chunk by chunk
+    Only the KEEP columns are parsed, with fixed dtypes
+    Rows with missing CPU, RAM or disk are dropped
+    Yield one DataFrame of at most chunksize rows at a time
+    """
+    reader = pd.read_csv(fname, compression='gzip', header=None, names=COLUMNS,
+                         usecols=KEEP, dtype=DTYPES, chunksize=chunksize,
+                         on_bad_lines='skip')  #read the data from .gz file
+    for chunk in reader:
+        chunk = chunk.dropna(subset=["CPU","RAM","local disk space"])  #drop the missing data
+        yield chunk[KEEP]
+
+
+def writeChunk(chunk, out):
+    """
+    Append one chunk to the opened output file
+    one task per line: timestamp jobID index priority CPU RAM disk
+    """
+    chunk.to_csv(out, sep=' ', header=False, index=False)
+
+
+def processShard(job):
+    """
+    Worker of the process pool, one shard per call
+    job: (shard file, part file, chunksize)
+    The shard is written to the part file sorted by timestamp
+    Return the number of tasks written
+    """
+    fname, partname, chunksize = job
+    chunks = list(readShard(fname, chunksize))
+    num = 0
+    with open(partname, 'w') as out:
+        if len(chunks) != 0:
+            data = pd.concat(chunks, ignore_index=True)
+            data = data.sort_values("timestamp", kind='stable')  #shards are almost sorted already
+            writeChunk(data, out)
+            num = len(data)
+    return num
+
+
+def timestamp(line):
+    """
+    Merge key of one line of a part file
+    """
+    return int(line.split(' ', 1)[0])
+
+
+def expandShards(patterns):
+    """
+    Expand glob patterns to the sorted list of shard files
+    """
+    fnames = []
+    for p in patterns:
+        match = sorted(glob.glob(p))
+        fnames.extend(match if len(match) != 0 else [p])
+    return fnames
+
+
+def preprocess(fnames, outname="input.txt", chunksize=100000, jobs=None):
+    """
+    Pre-process all shards into one input file for userWorkload
+    Shards are processed in parallel, one shard per worker
+    and the sorted parts are k-way merged by timestamp
+    Equal timestamps keep the shard order
+    Return the number of tasks written
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(fnames)))
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(outname))) as tmp:
+        parts = [os.path.join(tmp, "part%d.txt" % i) for i in range(len(fnames))]
+        work = [(f, p, chunksize) for f, p in zip(fnames, parts)]
+        if jobs == 1:
+            for fname, num in zip(fnames, map(processShard, work)):
+                print(fname, num)
+        else:
+            with Pool(jobs) as pool:
+                for fname, num in zip(fnames, pool.imap(processShard, work)):
+                    print(fname, num)
+        files = [open(p) for p in parts]
+        total = 0
+        with open(outname, 'w') as out:
+            for line in heapq.merge(*files, key=timestamp):
+                out.write(line)
+                total += 1
+        for f in files:
+            f.close()
+    print(outname, total)
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="pre-process google cluster task-event shards")
+    parser.add_argument("shards", nargs='*', default=SHARDS,
+                        help="task-event .csv.gz files or glob patterns, e.g. 'part-*.csv.gz'")
+    parser.add_argument("-o", "--output", default="input.txt")
+    parser.add_argument("-c", "--chunksize", type=int, default=100000, help="rows read at a time")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+    preprocess(expandShards(args.shards), args.output, args.chunksize, args.jobs)
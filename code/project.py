@@ -1,32 +1,204 @@
+# -*- coding: utf-8 -*-
 import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import importlib
+import contextlib
+from multiprocessing import Pool
 
-#pre-process file
-cmd = 'python preprocess.py'
-r = os.popen(cmd)
-r.close()
-
-#get task infor
-cmd = './userWorkload input.txt output_20000.txt'
-r = os.popen(cmd)
-r.close()
-
-#get environment-RR result
-cmd = 'python env_RR.py'
-r = os.popen(cmd)
-r.close()
-
-#get environment-dqn result
-cmd = 'python env_dqn.py'
-r = os.popen(cmd)
-r.close()
-
-#get improved-environment-rr result
-cmd = 'python improved_env_rr.py'
-r = os.popen(cmd)
-r.close()
-
-# #get result of RR
-# outfile = open("result.txt", 'w')    
-# outfile.write(str(r.read()) + "\n")
-# r.close()
-# outfile.close()
\ No newline at end of file
+#scheduler name: (module, local files it depends on)
+SCHEDULERS = {
+    "rr": ("env_rr", ["simulator.py", "cluster.py", "power.py", "tracefile.py", "rng.py"]),
+    "dqn": ("env_dqn", ["simulator.py", "cluster.py", "power.py", "tracefile.py", "rng.py", "DQN_skeleton.py"]),
+    "improved": ("improved_env_rr", ["simulator.py", "cluster.py", "power.py", "tracefile.py", "rng.py"]),
+}
+FIELDS = ["scheduler", "farms", "servers", "tasks", "reject", "time", "cost"]
+REPLAY = ["delay", "throughput", "utilization"]  #only with --speedup
+
+
+class Cache(object):
+    """
+    Content-addressed cache of stage outputs
+    The key of one output is the hash of everything it is built from:
+    input file contents, source code of the stage and parameters
+    File hashes are kept in files.json, a file is hashed again
+    only when its size or mtime changes
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.index = os.path.join(root, "files.json")
+        self.files = {}
+        if os.path.isfile(self.index):
+            with open(self.index) as f:
+                self.files = json.load(f)
+
+    def fileHash(self, fname):
+        """
+        sha256 of one file, or of all files of a directory
+        """
+        if os.path.isdir(fname):
+            h = hashlib.sha256()
+            for name in sorted(os.listdir(fname)):
+                h.update(name.encode())
+                h.update(self.fileHash(os.path.join(fname, name)).encode())
+            return h.hexdigest()
+        path = os.path.abspath(fname)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        if path in self.files and self.files[path][0] == stamp:
+            return self.files[path][1]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self.files[path] = [stamp, h.hexdigest()]
+        with open(self.index, 'w') as f:
+            json.dump(self.files, f)
+        return self.files[path][1]
+
+    def key(self, files, params):
+        """
+        Fingerprint of one stage: its input files and parameters
+        """
+        h = hashlib.sha256()
+        for fname in files:
+            h.update(self.fileHash(fname).encode())
+        h.update(json.dumps(params, sort_keys=True).encode())
+        return h.hexdigest()[:16]
+
+    def path(self, stage, key, ext=""):
+        return os.path.join(self.root, "%s-%s%s" % (stage, key, ext))
+
+    def build(self, stage, key, ext, fn):
+        """
+        Return the cached output of stage, run fn(tmp) to build it if missing
+        The output is moved in place only when fn finished
+        """
+        out = self.path(stage, key, ext)
+        if os.path.exists(out):
+            print(stage, "cached", out)
+            return out
+        tmp = out + ".tmp"
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        fn(tmp)
+        os.replace(tmp, out)
+        print(stage, "built", out)
+        return out
+
+
+def runScheduler(job):
+    """
+    Worker of the process pool, run one scheduler on one trace
+    job: (name, trace, scale, num_task, num_server, window, speedup, seed, log file)
+    Return the metrics of the run
+    """
+    name, trace, scale, num_task, num_server, window, speedup, seed, log = job
+    module = importlib.import_module(SCHEDULERS[name][0])
+    with open(log, 'w') as f, contextlib.redirect_stdout(f):
+        p1 = module.environment(scale, trace, num_task, num_server, window, speedup, seed)
+        p1.training()
+    row = {"scheduler": name, "farms": p1.farmNum, "servers": p1.severNum, "tasks": p1.num_task,
+           "reject": p1.rejRate, "time": p1.timecost, "cost": round(float(p1.totalcost), 3)}
+    if speedup is not None:
+        row.update(delay=round(p1.delay, 6), throughput=round(p1.throughput, 3),
+                   utilization=round(p1.utilization, 6))
+    return row
+
+
+def printTable(rows, out=sys.stdout):
+    """
+    Print the results as one table
+    """
+    fields = FIELDS + [f for f in REPLAY if len(rows) != 0 and f in rows[0]]
+    print(" ".join("%-10s" % f for f in fields), file=out)
+    for row in rows:
+        print(" ".join("%-10s" % row[f] for f in fields), file=out)
+
+
+def run(args):
+    """
+    preprocess -> workload -> schedulers
+    A stage is skipped when its output with the same key is cached
+    Schedulers that are not cached run in parallel
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    cache = Cache(args.cache)
+    import preprocess
+    import workload
+    from tracefile import writeTrace
+
+    #pre-process file
+    shards = preprocess.expandShards(args.shards)
+    key = cache.key(shards + [os.path.join(here, "preprocess.py")], {"chunksize": args.chunksize})
+    data = cache.build("input", key, ".txt",
+                       lambda tmp: preprocess.preprocess(shards, tmp, args.chunksize, args.jobs))
+
+    #get task infor, binary trace shared by all schedulers
+    src = [os.path.join(here, f) for f in ["workload.py", "tracefile.py"]]
+    arrival = args.speedup is not None  #replay reads jobs in arrival order
+    key = cache.key([data] + src, {"num": args.num, "arrival": arrival})
+    def group(tmp):
+        columns, offsets = workload.groupJobs(workload.readInput(data), args.num, arrival)
+        writeTrace(tmp, columns, offsets)
+    trace = cache.build("trace", key, "", group)
+
+    #get scheduler results
+    rows = {}
+    todo = []
+    for name in args.schedulers:
+        module, deps = SCHEDULERS[name]
+        src = [os.path.join(here, f) for f in [module + ".py"] + deps]
+        params = {"scale": args.scale, "tasks": args.tasks, "servers": args.servers,
+                  "window": args.window, "speedup": args.speedup, "seed": args.seed}
+        out = cache.path("result", cache.key([trace] + src, params), ".json")
+        if os.path.exists(out):
+            print(name, "cached", out)
+            with open(out) as f:
+                rows[name] = json.load(f)
+        else:
+            log = out[:-len(".json")] + ".log"
+            todo.append((out, (name, trace, args.scale, args.tasks, args.servers, args.window, args.speedup, args.seed, log)))
+    if len(todo) != 0:
+        with Pool(min(len(todo), args.jobs or os.cpu_count() or 1)) as pool:
+            for (out, job), row in zip(todo, pool.imap(runScheduler, [job for _, job in todo])):
+                with open(out, 'w') as f:
+                    json.dump(row, f)
+                print(job[0], "done", out)
+                rows[job[0]] = row
+    rows = [rows[name] for name in args.schedulers]
+    printTable(rows)
+    with open(args.output, 'w') as f:
+        printTable(rows, f)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="run the whole pipeline with cached stages")
+    parser.add_argument("shards", nargs='*', help="task-event shards or glob patterns (default: the bundled two)")
+    parser.add_argument("--num", type=int, default=20000, help="tasks kept by workload")
+    parser.add_argument("--tasks", type=int, default=5000, help="tasks run by each scheduler")
+    parser.add_argument("--servers", type=int, default=100)
+    parser.add_argument("--scale", default='small', choices=['small', 'large'])
+    parser.add_argument("--window", type=int, default=None, help="lookahead in queued tasks (default: read all jobs first)")
+    parser.add_argument("--speedup", type=float, default=None,
+                        help="replay trace arrival times this many times faster (default: all tasks at time 0)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--schedulers", default="rr,dqn,improved", help="comma separated: rr, dqn, improved")
+    parser.add_argument("-c", "--chunksize", type=int, default=100000)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--cache", default="cache")
+    parser.add_argument("-o", "--output", default="result.txt")
+    args = parser.parse_args()
+    if not args.shards:
+        from preprocess import SHARDS
+        args.shards = SHARDS
+    args.schedulers = args.schedulers.split(',')
+    for name in args.schedulers:
+        if name not in SCHEDULERS:
+            parser.error("unknown scheduler: " + name)
+    run(args)
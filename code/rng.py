@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#######################################################
+# seeded random streams of RP/TS processor            #
+# one numpy Generator per subsystem, all spawned from #
+# one SeedSequence: each subsystem draws the same     #
+# numbers whatever the others draw                    #
+#######################################################
+
+import numpy as np
+
+#task: runtime and ddl, dag: dependencies, divide: sub tasks,
+#farm: servers per farm, release: random release, vm: VM choice of DQN,
+#agent: epsilon-greedy choice of the DQN agents
+STREAMS = ["task", "dag", "divide", "farm", "release", "vm", "agent"]
+
+
+class Draws(object):
+    """
+    Uniform numbers of one Generator, drawn block by block
+    so that a scalar draw is a slice of the block instead of a call
+    randints and randint include hi, like random.randint
+    (unlike Generator.integers, which excludes it)
+    """
+    def __init__(self, gen, block=4096):
+        self.gen = gen
+        self.block = block
+        self.buf = np.empty(0)
+        self.pos = 0
+
+    def draw(self, n):
+        """
+        n uniform numbers in [0, 1)
+        """
+        if self.pos + n > len(self.buf):
+            self.buf = np.concatenate((self.buf[self.pos:], self.gen.random(max(n, self.block))))
+            self.pos = 0
+        u = self.buf[self.pos:self.pos + n]
+        self.pos += n
+        return u
+
+    def randints(self, lo, hi, n):
+        """
+        n integers in [lo, hi]
+        """
+        return lo + (self.draw(n) * (hi - lo + 1)).astype(np.int64)
+
+    def random(self):
+        return float(self.draw(1)[0])
+
+    def randint(self, lo, hi):
+        return lo + int(self.draw(1)[0] * (hi - lo + 1))
+
+    def uniform(self, lo, hi):
+        return lo + (hi - lo) * float(self.draw(1)[0])
+
+
+class Streams(object):
+    """
+    The random streams of one run
+    seed: int, or None for fresh entropy
+    """
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.seq = np.random.SeedSequence(seed)
+        for name, child in zip(STREAMS, self.seq.spawn(len(STREAMS))):
+            setattr(self, name, Draws(np.random.default_rng(child)))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#######################################################
+# discrete-event simulation clock of RP/TS processor  #
+# events are kept in a priority queue ordered by time #
+# the clock only moves when an event is handled       #
+#######################################################
+
+import heapq
+
+ARRIVAL = 0     #task arrives and enters the ready queue
+COMPLETION = 1  #running task reaches its endtime
+RELEASE = 2     #resources of a finished task go back to its VM
+
+
+class Simulator(object):
+    """
+    Simulated clock backed by an event priority queue
+    now is the current simulated time (starts at 0)
+    Events with the same time are handled in the order
+    ARRIVAL, COMPLETION, RELEASE and then first in first out
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.events = []
+        self.count = 0  #tie breaker, keep insert order for same time and kind
+
+    def schedule(self, time, kind, data=None):
+        """
+        Put one event into the queue
+        An event in the past happens at the current time
+        """
+        if time < self.now:
+            time = self.now
+        heapq.heappush(self.events, (time, kind, self.count, data))
+        self.count += 1
+
+    def empty(self):
+        """
+        Return True if there is no pending event
+        """
+        return len(self.events) == 0
+
+    def nextTime(self):
+        """
+        Time of the next pending event, None if there is no event
+        """
+        if self.empty():
+            return None
+        return self.events[0][0]
+
+    def step(self):
+        """
+        Jump the clock straight to the next event time
+        Return all (kind, data) events that happen at that time
+        """
+        batch = []
+        if self.empty():
+            return batch
+        self.now = self.events[0][0]
+        while len(self.events) != 0 and self.events[0][0] <= self.now:
+            _, kind, _, data = heapq.heappop(self.events)
+            batch.append((kind, data))
+        return batch
+
+
+class Monitor(object):
+    """
+    Load metrics of one run on the simulated clock
+    delay: mean queueing delay, from arrival to placement of a task
+    throughput: placed tasks per simulated second
+    utilization: time average of the used share of the cluster CPU
+    """
+    def __init__(self):
+        self.cluster = None
+        self.capacity = 0.0
+        self.start = None  #time of the first task arrival
+        self.last = 0.0
+        self.busy = 0.0  #used CPU integrated over time
+        self.delay = 0.0
+        self.placed = 0
+
+    def watch(self, cluster):
+        """
+        Measure the utilization of cluster
+        """
+        self.cluster = cluster
+        self.capacity = float(cluster.farm[0].sum())
+
+    def tick(self, now):
+        """
+        Called before the clock jumps to now
+        """
+        if now is None:
+            return
+        if self.cluster is not None:
+            used = self.capacity - float(self.cluster.farm[0].sum())
+            self.busy += used * (now - self.last)
+        self.last = now
+
+    def arrive(self, now):
+        """
+        One task of the trace arrives at now
+        Tasks already arrived when they are read come without an event,
+        so the window starts at the earliest arrival seen
+        """
+        if self.start is None or now < self.start:
+            self.start = now
+
+    def place(self, task, now):
+        """
+        One task starts running
+        """
+        self.delay += now - task.arrival
+        self.placed += 1
+
+    def summary(self):
+        """
+        Return (delay, throughput, utilization)
+        """
+        span = self.last - (self.start or 0.0)
+        delay = self.delay / self.placed if self.placed else 0.0
+        throughput = self.placed / span if span > 0 else 0.0
+        utilization = self.busy / (self.capacity * span) if span > 0 and self.capacity > 0 else 0.0
+        return delay, throughput, utilization
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#######################################################
+# seeded synthetic workload of RP/TS processor        #
+# CPU, RAM, disk, priority and job sizes are fitted   #
+# from the google cluster shards, every column is     #
+# drawn at once with numpy (10M tasks in seconds)     #
+# output: binary trace (default) or userWorkload text #
+#######################################################
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from tracefile import Trace, writeTrace
+
+SIZES = ["empirical", "geometric", "lognormal", "fixed"]
+
+
+def fitShards(fnames, chunksize=100000, sample=100000):
+    """
+    Fit the workload of the task-event shards
+    Only the first event of each task is used, like userWorkload
+    Return a dict of arrays:
+    resource: rows of (CPU, RAM, disk) drawn from the shards, at most sample rows
+    priority: priority of the same rows
+    sizes: number of tasks of each job
+    rate: jobs per second, from the first timestamp of each job
+    """
+    import preprocess
+    chunks = [c for f in fnames for c in preprocess.readShard(f, chunksize)]
+    data = pd.concat(chunks, ignore_index=True)
+    data = data.drop_duplicates(["jobID", "taskindex​-withinthejob"])  #repeated task events
+    resource = data[["CPU", "RAM", "local disk space"]].to_numpy(np.float64)
+    priority = data["priority"].to_numpy(np.int8)
+    if len(resource) > sample:
+        keep = np.random.default_rng(0).choice(len(resource), sample, replace=False)
+        resource, priority = resource[keep], priority[keep]
+    sizes = data.groupby("jobID").size().to_numpy(np.int64)
+    first = data.groupby("jobID")["timestamp"].min().to_numpy(np.int64)
+    first = first[first > 0]  #0: already running when the trace starts
+    rate = (len(first) - 1) / ((first.max() - first.min()) / 1e6) if len(first) > 1 else 1.0
+    return {"resource": resource, "priority": priority, "sizes": sizes, "rate": np.float64(rate)}
+
+
+def loadFit(fname, shards=None, chunksize=100000):
+    """
+    Load a fit saved by np.savez, fit the shards and save it if missing
+    """
+    if not os.path.isfile(fname):
+        if shards is None:
+            from preprocess import SHARDS
+            shards = SHARDS
+        np.savez(fname, **fitShards(shards, chunksize))
+    with np.load(fname) as f:
+        return dict((name, f[name]) for name in f.files)
+
+
+def jobSizes(rng, num_task, fit, dist="empirical", mean=None, sigma=1.0):
+    """
+    Draw job sizes until num_task tasks are covered, the last job is cut
+    dist: empirical (sizes of the shards), geometric, lognormal or fixed
+    mean: mean job size, default the mean of the shards
+    Return the job offsets
+    """
+    if mean is None:
+        mean = float(fit["sizes"].mean())
+    parts = []
+    total = 0
+    while total < num_task:
+        k = max(16, int((num_task - total) / mean * 1.1))
+        if dist == "empirical":
+            s = fit["sizes"][rng.integers(0, len(fit["sizes"]), k)]
+        elif dist == "geometric":
+            s = rng.geometric(1.0 / mean, k)
+        elif dist == "lognormal":
+            s = np.ceil(rng.lognormal(np.log(mean) - sigma * sigma / 2, sigma, k))
+        elif dist == "fixed":
+            s = np.full(k, round(mean))
+        else:
+            raise ValueError("unknown job size distribution: " + dist)
+        s = np.maximum(s.astype(np.int64), 1)
+        parts.append(s)
+        total += int(s.sum())
+    offsets = np.concatenate([[0], np.cumsum(np.concatenate(parts))])
+    last = int(np.searchsorted(offsets, num_task))
+    offsets = offsets[:last + 1]
+    offsets[-1] = num_task
+    return offsets
+
+
+def generate(num_task, fit, seed=0, sizes="empirical", mean=None, sigma=1.0, density=0.5, rate=None):
+    """
+    Draw a workload of num_task tasks
+    density: chance that a task depends on an earlier task of its job,
+    the parent is uniform over them so every job is a forest
+    rate: jobs per second of the poisson arrivals, 0 puts every job at 0,
+    default the rate of the shards
+    Return the columns and job offsets, in the order of tracefile.COLUMNS
+    """
+    rng = np.random.default_rng(seed)
+    offsets = jobSizes(rng, num_task, fit, sizes, mean, sigma)
+    size = np.diff(offsets)
+    start = np.repeat(offsets[:-1], size)
+    pos = np.arange(num_task, dtype=np.int64) - start  #position in the job
+    row = rng.integers(0, len(fit["resource"]), num_task)  #cpu, ram and disk stay correlated
+    resource = fit["resource"][row]
+    parent = np.full(num_task, -1, dtype=np.int32)
+    linked = (pos > 0) & (rng.random(num_task) < density)
+    parent[linked] = (rng.random(int(linked.sum())) * pos[linked]).astype(np.int32)
+    if rate is None:
+        rate = float(fit["rate"])
+    if rate > 0:
+        arrival = np.cumsum(rng.exponential(1e6 / rate, len(size))).astype(np.int64)
+    else:
+        arrival = np.zeros(len(size), dtype=np.int64)
+    columns = {"timestamp": np.repeat(arrival, size),
+               "jobID": np.repeat(np.arange(1, len(size) + 1, dtype=np.int64), size),
+               "index": pos.astype(np.int32),
+               "priority": fit["priority"][row],
+               "CPU": resource[:, 0], "RAM": resource[:, 1], "disk": resource[:, 2],
+               "parent": parent}
+    return columns, offsets
+
+
+def synthetic(num_task, fit="synthetic_fit.npz", **kwargs):
+    """
+    Generate in memory
+    Return a Trace that the environments can read directly
+    e.g. environment('small', synthetic(5000, seed=1), 5000, 100)
+    """
+    columns, offsets = generate(num_task, loadFit(fit), **kwargs)
+    return Trace("synthetic", columns, offsets)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="generate a synthetic workload fitted from the google shards")
+    parser.add_argument("output", nargs='?', default="synthetic.trace")
+    parser.add_argument("-n", "--num", type=int, default=1000000, help="number of tasks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sizes", default="empirical", choices=SIZES, help="job size distribution")
+    parser.add_argument("--mean", type=float, default=None, help="mean job size (default: the shards)")
+    parser.add_argument("--sigma", type=float, default=1.0, help="sigma of lognormal job sizes")
+    parser.add_argument("--density", type=float, default=0.5, help="chance that a task has a parent")
+    parser.add_argument("--rate", type=float, default=None, help="jobs per second, 0: all at time 0 (default: the shards)")
+    parser.add_argument("--fit", default="synthetic_fit.npz", help="fitted shards, made if missing")
+    parser.add_argument("--shards", nargs='*', default=None, help="shards to fit (default: the bundled two)")
+    parser.add_argument("--text", action='store_true', help="write userWorkload text instead of a binary trace")
+    args = parser.parse_args()
+    fit = loadFit(args.fit, args.shards)
+    columns, offsets = generate(args.num, fit, args.seed, args.sizes, args.mean, args.sigma,
+                                args.density, args.rate)
+    if args.text:
+        from workload import writeText
+        writeText(args.output, columns, offsets)
+    else:
+        writeTrace(args.output, columns, offsets)
+    print("task number:", int(offsets[-1]), "jobs:", len(offsets) - 1)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#######################################################
+# regression test of the batched RR search: searchRR  #
+# of env_rr and improved_env_rr must make the same    #
+# decisions as the original server by server loop     #
+# run with: python -m pytest test_rr_search.py        #
+#######################################################
+
+import os
+import pytest
+import env_rr
+import improved_env_rr
+
+TRACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output_5000.txt")
+
+
+def loopRR(env, t, i):
+    """
+    The original server by server, VM by VM search of RR
+    Return (server_i, vm_j), or (-1, -1) if no VM fits
+    """
+    server_pass = 0
+    server_i = i
+    vm_j = 0
+    rej = env.checkRej(server_i, vm_j, t)
+    while rej != 0 and server_pass <= env.severNum:
+        rej = env.checkRej(server_i, vm_j, t)
+        #find which VM
+        while vm_j < env.VMNum and rej != 0:
+            vm_j += 1
+        if vm_j == env.VMNum:  #this server not meet the requirement
+            server_pass += 1
+            vm_j = 0
+            server_i += 1  #go to next server
+        else:
+            break
+        if server_i == env.severNum:
+            server_i = 0
+        rej = env.checkRej(server_i, vm_j, t)
+    if server_pass <= env.severNum and vm_j < env.VMNum:
+        return server_i, vm_j
+    return -1, -1
+
+
+def compare(module, num_task=5000, num_server=100, seed=0):
+    """
+    Run RR with searchRR, checking every decision against loopRR
+    Return the number of decisions and of mismatches
+    """
+    env = module.environment('small', TRACE, num_task, num_server, seed=seed)
+    search = env.searchRR
+    count = {"decisions": 0, "mismatches": 0}
+
+    def checked(t, i):
+        found = search(t, i)
+        count["decisions"] += 1
+        if found != loopRR(env, t, i):
+            count["mismatches"] += 1
+        return found
+
+    env.searchRR = checked
+    env.training()
+    return count["decisions"], count["mismatches"]
+
+
+@pytest.mark.parametrize("module", [env_rr, improved_env_rr], ids=["env_rr", "improved_env_rr"])
+def test_search_matches_loop(module):
+    decisions, mismatches = compare(module)
+    assert decisions > 0
+    assert mismatches == 0
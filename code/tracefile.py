@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#######################################################
+# binary columnar task trace of RP/TS processor       #
+# one .npy file per column plus job offsets, opened   #
+# with np.load(mmap_mode='r'): zero copy and pages    #
+# are shared by all processes reading the same trace  #
+#######################################################
+
+import os
+import sys
+from sys import intern
+import numpy as np
+
+#column name and dtype, tasks are stored job by job
+COLUMNS = [("timestamp", np.int64), ("jobID", np.int64), ("index", np.int32),
+           ("priority", np.int8), ("CPU", np.float64), ("RAM", np.float64),
+           ("disk", np.float64)]
+#optional column: position of the parent task in its job, -1: none
+#written by synthetic.py, without it the environments draw the DAG
+PARENT = ("parent", np.int32)
+
+
+def isTrace(fname):
+    """
+    Return True if fname is a binary trace directory
+    or a Trace already in memory
+    """
+    if isinstance(fname, Trace):
+        return True
+    return os.path.isfile(os.path.join(fname, "offsets.npy"))
+
+
+def openTrace(fname):
+    """
+    Open a binary trace directory, a Trace is returned as it is
+    """
+    if isinstance(fname, Trace):
+        return fname
+    return Trace(fname)
+
+
+def writeTrace(dirname, columns, offsets):
+    """
+    Write a binary trace
+    columns: dict of column name to array, one row per task
+    offsets: first task of each job, plus the number of tasks at the end
+    """
+    os.makedirs(dirname, exist_ok=True)
+    for name, dtype in COLUMNS + [PARENT]:
+        if name not in columns:
+            continue
+        np.save(os.path.join(dirname, name + ".npy"), np.asarray(columns[name], dtype=dtype))
+    np.save(os.path.join(dirname, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+
+def textToTrace(fname, dirname):
+    """
+    Convert a userWorkload text file ("Job ID:" headers, then
+    timestamp jobID index priority CPU RAM disk [parent] per line) to a binary trace
+    Return the number of tasks
+    """
+    columns = dict((name, []) for name, _ in COLUMNS + [PARENT])
+    offsets = []
+    num_task = 0
+    with open(fname, 'r') as f:
+        for line in f:
+            if line[0] == 'J':
+                offsets.append(num_task)
+                continue
+            info = line.split()
+            if len(info) not in (7, 8):
+                continue
+            columns["timestamp"].append(int(float(info[0])))
+            columns["jobID"].append(int(info[1]))
+            columns["index"].append(int(info[2]))
+            columns["priority"].append(int(info[3]))
+            columns["CPU"].append(float(info[4]))
+            columns["RAM"].append(float(info[5]))
+            columns["disk"].append(float(info[6]))
+            columns["parent"].append(int(info[7]) if len(info) == 8 else -1)
+            num_task += 1
+    offsets.append(num_task)
+    offsets = np.unique(offsets)  #drop empty jobs
+    if np.all(np.asarray(columns["parent"]) < 0):
+        del columns["parent"]  #no dependencies given
+    writeTrace(dirname, columns, offsets)
+    return num_task
+
+
+class Trace(object):
+    """
+    Memory-mapped binary trace
+    Each column is a read-only np.memmap, offsets[j]:offsets[j+1]
+    are the tasks of job j
+    A trace can also be built in memory from columns and offsets
+    (e.g. by workload.py), then nothing is read from dirname
+    parent is None when the trace has no parent column
+    """
+    def __init__(self, dirname, columns=None, offsets=None):
+        self.dirname = dirname
+        for name, dtype in COLUMNS:
+            if columns is None:
+                setattr(self, name, np.load(os.path.join(dirname, name + ".npy"), mmap_mode='r'))
+            else:
+                setattr(self, name, np.asarray(columns[name], dtype=dtype))
+        if offsets is None:
+            self.offsets = np.load(os.path.join(dirname, "offsets.npy"), mmap_mode='r')
+        else:
+            self.offsets = np.asarray(offsets, dtype=np.int64)
+        name, dtype = PARENT
+        if columns is None:
+            fname = os.path.join(dirname, name + ".npy")
+            self.parent = np.load(fname, mmap_mode='r') if os.path.isfile(fname) else None
+        else:
+            self.parent = np.asarray(columns[name], dtype=dtype) if name in columns else None
+        self.numJob = len(self.offsets) - 1
+        self.numTask = int(self.offsets[-1])
+
+    def jobs(self, num_task=None):
+        """
+        Yield the first num_task tasks job by job
+        Each job is a list of (jobID, index, CPU, RAM, disk, timestamp, parent)
+        with string ids, the same values as the text reader gives
+        parent is None for every task if the trace has no parent column
+        Only the pages of the current job are read
+        """
+        n = self.numTask if num_task is None else min(num_task, self.numTask)
+        for j in range(self.numJob):
+            lo = int(self.offsets[j])
+            if lo >= n:
+                break
+            hi = min(int(self.offsets[j + 1]), n)
+            job = intern(str(int(self.jobID[lo])))
+            index = [intern(str(i)) for i in self.index[lo:hi].tolist()]
+            parent = [None] * (hi - lo) if self.parent is None else self.parent[lo:hi].tolist()
+            yield list(zip([job] * (hi - lo), index, self.CPU[lo:hi].tolist(),
+                           self.RAM[lo:hi].tolist(), self.disk[lo:hi].tolist(),
+                           self.timestamp[lo:hi].tolist(), parent))
+
+
+if __name__ == '__main__':
+    #python tracefile.py output_5000.txt output_5000.trace
+    if len(sys.argv) != 3:
+        print("usage: python tracefile.py <userWorkload output.txt> <trace dir>")
+        sys.exit(1)
+    num = textToTrace(sys.argv[1], sys.argv[2])
+    print(sys.argv[2], num, "tasks")
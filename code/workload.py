@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#######################################################
+# group the pre-processed tasks by job                #
+# the same output as userWorkload.cpp: jobs in jobID  #
+# order, tasks sorted by index, repeated index dropped#
+# input: input.txt made by preprocess.py              #
+# output: text file, binary trace or a Trace object   #
+#######################################################
+
+import argparse
+import numpy as np
+import pandas as pd
+from tracefile import COLUMNS, PARENT, Trace, writeTrace
+
+
+def readInput(fname):
+    """
+    Read input.txt (timestamp jobID index priority CPU RAM disk per line)
+    Return a dict of column name to array
+    """
+    data = pd.read_csv(fname, sep=' ', header=None, names=[name for name, _ in COLUMNS],
+                       dtype=dict(COLUMNS), on_bad_lines='skip')
+    data = data.dropna()
+    return dict((name, data[name].to_numpy()) for name, _ in COLUMNS)
+
+
+def groupJobs(columns, num_task=200000, arrival=False):
+    """
+    Sort tasks by jobID and then task index (lexsort, stable)
+    Only the first task of a repeated (jobID, index) is kept
+    and at most num_task tasks are kept (MAX_TIME of userWorkload)
+    arrival: put the jobs in the order of their first timestamp instead,
+    needed to replay arrivals with a lookahead window
+    Return the sorted columns and the job offsets
+    """
+    job = np.asarray(columns["jobID"])
+    index = np.asarray(columns["index"])
+    order = np.lexsort((index, job))
+    job = job[order]
+    index = index[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (job[1:] != job[:-1]) | (index[1:] != index[:-1])  #repeated task index
+    order = order[keep]
+    if arrival and len(order) != 0:
+        job = job[keep]
+        start = np.flatnonzero(np.r_[True, job[1:] != job[:-1]])
+        first = np.minimum.reduceat(np.asarray(columns["timestamp"])[order], start)
+        size = np.diff(np.append(start, len(order)))
+        rank = np.empty(len(start), dtype=np.int64)
+        rank[np.argsort(first, kind='stable')] = np.arange(len(start))  #ties keep the jobID order
+        order = order[np.argsort(np.repeat(rank, size), kind='stable')]
+    if num_task is not None:
+        order = order[:num_task]
+    grouped = dict((name, np.asarray(columns[name])[order]) for name, _ in COLUMNS)
+    job = grouped["jobID"]
+    start = np.flatnonzero(np.r_[True, job[1:] != job[:-1]]) if len(job) != 0 else np.zeros(0, dtype=np.int64)
+    offsets = np.append(start, len(job))
+    return grouped, offsets
+
+
+def workload(fname, num_task=200000, arrival=False):
+    """
+    Group input.txt in memory
+    Return a Trace that the environments can read directly
+    e.g. environment('small', workload('input.txt', 5000), 5000, 100)
+    """
+    columns, offsets = groupJobs(readInput(fname), num_task, arrival)
+    return Trace(fname, columns, offsets)
+
+
+def writeText(fname, columns, offsets):
+    """
+    Write the grouped tasks in the userWorkload text format
+    The parent column, if any, is written as an eighth field
+    """
+    names = [name for name, _ in COLUMNS + [PARENT] if name in columns]
+    rows = zip(*[columns[name].tolist() for name in names])
+    with open(fname, 'w') as out:
+        for j in range(len(offsets) - 1):
+            n = int(offsets[j + 1] - offsets[j])
+            out.write("Job ID: %d\n" % columns["jobID"][offsets[j]])
+            for _ in range(n):
+                out.write(" ".join(map(str, next(rows))) + "\n")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="group tasks by job, replaces ./userWorkload")
+    parser.add_argument("input", nargs='?', default="input.txt")
+    parser.add_argument("output", nargs='?', default="output_200000.txt")
+    parser.add_argument("-n", "--num", type=int, default=200000, help="number of tasks to keep")
+    parser.add_argument("--trace", action='store_true', help="write a binary trace directory instead of text")
+    parser.add_argument("--arrival", action='store_true', help="order jobs by their first timestamp")
+    args = parser.parse_args()
+    columns, offsets = groupJobs(readInput(args.input), args.num, args.arrival)
+    if args.trace:
+        writeTrace(args.output, columns, offsets)
+    else:
+        writeText(args.output, columns, offsets)
+    print("task number:", int(offsets[-1]))
@@ -16,6 +16,9 @@ class Task(object):
     jobID, index, CPU, RAM, disk extracted from user data
     status indicates the current status of the task
     """
+    __slots__ = ('parent', 'child', 'jobID', 'index', 'CPU', 'RAM', 'disk',
+                 'status', 'ddl', 'runtime')  #no __dict__ per task
+
     def __init__(self, jobID, index, CPU, RAM, disk, status):
         self.parent = []
         self.child = []
@@ -53,7 +56,7 @@ class DAG(object):
                         task = []
                 else:
                     info = list(line.strip(' ').split())
-                    task.append(Task(info[1], info[2], info[4], info[5], info[6], 1))
+                    task.append(Task(info[1], info[2], float(info[4]), float(info[5]), float(info[6]), 1))
                     num_task += 1
                 if num_task == self.num_task: 
                     break
@@ -315,8 +318,8 @@ class environment(object):
             random.shuffle(self.VMtask[ranSer][ranVM])
             t = self.VMtask[ranSer][ranVM].pop()
             t.status = 0
-            self.VM[ranSer][ranVM][0] += float(t.CPU)
-            self.VM[ranSer][ranVM][1] += float(t.RAM)
+            self.VM[ranSer][ranVM][0] += t.CPU
+            self.VM[ranSer][ranVM][1] += t.RAM
 
     def training(self):
         """
@@ -344,8 +347,8 @@ class environment(object):
         Check whether this task should be rejected in ith sever, jth VM
         Reject task when remain_cpu or remain_ram or remain_ram < 0
         """
-        remain_cpu = self.VM[server_i][vm_j][0] - float(task.CPU)
-        remain_ram = self.VM[server_i][vm_j][1] - float(task.RAM)
+        remain_cpu = self.VM[server_i][vm_j][0] - task.CPU
+        remain_ram = self.VM[server_i][vm_j][1] - task.RAM
         if remain_cpu >= 0 and remain_ram >=0 and self.curtime + task.runtime <= task.ddl:
             return False
         return True
@@ -372,11 +375,11 @@ class environment(object):
             decision = [0, 5]
             if not self.checkRej(decision[0], decision[1], t):
                 self.VMtask[decision[0]][decision[1]].append(t)
-                self.VM[decision[0]][decision[1]][0] -= float(t.CPU)
-                self.VM[decision[0]][decision[1]][1] -= float(t.RAM)
-                self.severs[decision[0]][0] -= float(t.CPU)  
-                self.severs[decision[0]][1] -= float(t.RAM) 
-                self.severs[decision[0]][2] -= float(t.disk)
+                self.VM[decision[0]][decision[1]][0] -= t.CPU
+                self.VM[decision[0]][decision[1]][1] -= t.RAM
+                self.severs[decision[0]][0] -= t.CPU  
+                self.severs[decision[0]][1] -= t.RAM 
+                self.severs[decision[0]][2] -= t.disk
             else:
                 t.status = -1
                 self.dag.updateStatus(t)
@@ -422,11 +425,11 @@ class environment(object):
                 continue
             decision = [server_i, vm_j]
             self.VMtask[decision[0]][decision[1]].append(t)
-            self.VM[decision[0]][decision[1]][0] -= float(t.CPU)
-            self.VM[decision[0]][decision[1]][1] -= float(t.RAM)
-            self.severs[decision[0]][0] -= float(t.CPU)  
-            self.severs[decision[0]][1] -= float(t.RAM) 
-            self.severs[decision[0]][2] -= float(t.disk)
+            self.VM[decision[0]][decision[1]][0] -= t.CPU
+            self.VM[decision[0]][decision[1]][1] -= t.RAM
+            self.severs[decision[0]][0] -= t.CPU  
+            self.severs[decision[0]][1] -= t.RAM 
+            self.severs[decision[0]][2] -= t.disk
             t.status = 0  #finish task
             i += 1
         print("Reject rate: ", rej, end=' ')        